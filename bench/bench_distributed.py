@@ -0,0 +1,137 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    bench_distributed.py: Several TEDTalks.py at once in a shared folder
+"""
+
+#==============================================================================
+# Runs N processes of TEDTalks.py in distributed mode (-d) at the same time,
+# in the same folder, against a local stand-in of the TED servers
+# (tedserver.py, used as their HTTP proxy), as several hosts would do with a
+# shared folder. Checks that every talk is downloaded exactly once (the bytes
+# of every video sent by the stand-in are its size, every subtitle is asked
+# for once) and that no lease is left, and reports the seconds that they
+# took. It fails if any check fails:
+#
+#   python bench_distributed.py [-p PROCESSES] [-n TALKS] [-s VIDEO_SIZE]
+#                               [-l LATENCY] [-b BANDWIDTH]
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+
+import tedserver
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                   'src')
+
+
+def run_all(processes, folder, port, extra):
+    """Run the processes of TEDTalks.py at once, return their seconds."""
+    env = dict(os.environ, http_proxy='http://127.0.0.1:{0}'.format(port))
+    env.pop('no_proxy', None)
+    start = time.time()
+    procs = [Popen([sys.executable, os.path.join(SRC, 'TEDTalks.py'),
+                    '--no-mail', '-d', folder] + extra, cwd=folder, env=env,
+                   stdout=PIPE, stderr=PIPE) for _ in range(processes)]
+    for proc in procs:
+        _, error = proc.communicate()
+        if proc.returncode:
+            sys.stderr.write(error)
+            raise SystemExit('TEDTalks.py failed')
+    return time.time() - start
+
+
+def check(stand_in, folder):
+    """The problems found in the folder and in the stand-in's counters."""
+    problems = []
+    for idx in range(stand_in.talks):
+        video = 'Speaker{0}_480.mp4'.format(idx)
+        name = os.path.join(folder, video)
+        size = os.path.getsize(name) if os.path.exists(name) else None
+        if size != stand_in.video_size:
+            problems.append('{0}: {1} of {2} bytes'.
+                            format(video, size, stand_in.video_size))
+        sent = stand_in.sent.get(video, 0)
+        if sent != stand_in.video_size:
+            problems.append('{0}: {1} bytes sent, downloaded {2:.2f} times'.
+                            format(video, sent,
+                                   sent / float(stand_in.video_size)))
+    subs = glob.glob(os.path.join(folder, '*.srt'))
+    if stand_in.requests.get('subtitle', 0) != len(subs):
+        problems.append('{0} subtitles asked for, {1} downloaded'.
+                        format(stand_in.requests.get('subtitle', 0),
+                               len(subs)))
+    for left in glob.glob(os.path.join(folder, '*.lease*')):
+        problems.append('{0} left'.format(os.path.basename(left)))
+    return problems
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="Several TEDTalks.py at once in a "
+                            "shared folder against a local stand-in of TED")
+    parser.add_argument("-p", "--processes", type=int, default=4,
+                        help="number of processes of TEDTalks.py")
+    parser.add_argument("-n", "--talks", type=int, default=20,
+                        help="number of talks in the feed")
+    parser.add_argument("-s", "--video-size", type=int, default=2 ** 20,
+                        help="bytes of every video")
+    parser.add_argument("-l", "--latency", type=float, default=20,
+                        help="milliseconds to wait before every response")
+    parser.add_argument("-b", "--bandwidth", type=float, default=1024,
+                        help="KiB per second of every connection (0, no "
+                        "limit)")
+    parser.add_argument("extra", nargs='*', metavar="ARG",
+                        help="extra arguments for TEDTalks.py (after --)")
+    args = parser.parse_args()
+
+    stand_in = tedserver.TEDStandIn(args.talks, args.video_size,
+                                    args.latency / 1000.0,
+                                    args.bandwidth * 1024)
+    port = stand_in.start()
+    folder = tempfile.mkdtemp(prefix='distributed-')
+    try:
+        elapsed = run_all(args.processes, folder, port, args.extra)
+        problems = check(stand_in, folder)
+    finally:
+        stand_in.stop()
+        shutil.rmtree(folder)
+
+    print('{0} processes {1:3d} talks {2:8.2f} s {3:8.1f} talks/min'.
+          format(args.processes, args.talks, elapsed,
+                 args.talks * 60 / elapsed))
+    requests = sorted(stand_in.requests.items())
+    print('Requests   {0}'.format(', '.join('{0}: {1}'.format(kind, count)
+                                            for kind, count in requests)))
+    if problems:
+        raise SystemExit('Not downloaded exactly once:{0}  {1}'.
+                         format(os.linesep, (os.linesep + '  ').
+                                join(problems)))
+    print('Every talk downloaded exactly once')
+
+
+if __name__ == "__main__":
+    main()
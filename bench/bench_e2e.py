@@ -0,0 +1,191 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    bench_e2e.py: End to end throughput of TEDTalks.py & TEDSubs.py
+"""
+
+#==============================================================================
+# Runs both scripts, as they run in production, against a local stand-in of
+# the TED servers (tedserver.py, used as their HTTP proxy) and reports:
+#
+#  - talks per minute and MB/s of the videos downloaded by TEDTalks.py
+#  - talks per minute of TEDSubs.py (page scrape, subtitles and video), a run
+#    per talk and all of them in a run (batch mode)
+#  - subtitle conversions per second (JSON to SRT, in this process)
+#  - the peak RSS of every script
+#
+#   python bench_e2e.py [-n TALKS] [-s VIDEO_SIZE] [-l LATENCY] [-b BANDWIDTH]
+#                       [-t CAPACITY]
+#
+# Use -j FILE to save the results as JSON and compare them between versions.
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+
+import tedserver
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                   'src')
+
+
+def run(script, args, cwd, port):
+    """Run a script through the stand-in, return its seconds & peak RSS.
+
+    The peak RSS (KiB in Linux) is the one of the script's process only.
+
+    """
+    env = dict(os.environ, http_proxy='http://127.0.0.1:{0}'.format(port))
+    env.pop('no_proxy', None)
+    start = time.time()
+    proc = Popen([sys.executable, os.path.join(SRC, script)] + args, cwd=cwd,
+                 env=env, stdout=PIPE, stderr=PIPE)
+    proc.stdout.read()
+    error = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    if status:
+        sys.stderr.write(error)
+        raise SystemExit('{0} failed'.format(script))
+    return elapsed, usage.ru_maxrss
+
+
+def bench_tedtalks(stand_in, port, args):
+    """Download all the talks of the feed with TEDTalks.py."""
+    folder = tempfile.mkdtemp(prefix='tedtalks-')
+    try:
+        elapsed, rss = run('TEDTalks.py', ['--no-mail', folder] + args.extra,
+                           folder, port)
+        videos = glob.glob(os.path.join(folder, '*.mp4'))
+        subs = glob.glob(os.path.join(folder, '*.srt'))
+        size = sum(os.path.getsize(video) for video in videos)
+    finally:
+        shutil.rmtree(folder)
+    return {'seconds': elapsed, 'talks': len(videos), 'subtitles': len(subs),
+            'talks_per_min': len(videos) * 60 / elapsed,
+            'mb_per_sec': size / 2.0 ** 20 / elapsed, 'peak_rss_kib': rss}
+
+
+def bench_tedsubs(stand_in, port, args, batch=False):
+    """Download every talk with TEDSubs.py, one after another (a run each) or
+    all of them in a run, in batch mode."""
+    folder = tempfile.mkdtemp(prefix='tedsubs-')
+    urls = ['{0}/Speaker{1}.html'.format(tedserver.TALKS_URL, idx)
+            for idx in range(stand_in.talks)]
+    try:
+        elapsed, rss = 0, 0
+        for run_urls in ([urls] if batch else [[url] for url in urls]):
+            seconds, peak = run('TEDSubs.py', run_urls, folder, port)
+            elapsed += seconds
+            rss = max(rss, peak)
+        videos = glob.glob(os.path.join(folder, '*.mp4'))
+        size = sum(os.path.getsize(video) for video in videos)
+    finally:
+        shutil.rmtree(folder)
+    return {'seconds': elapsed, 'talks': len(videos),
+            'talks_per_min': len(videos) * 60 / elapsed,
+            'mb_per_sec': size / 2.0 ** 20 / elapsed, 'peak_rss_kib': rss}
+
+
+def bench_conversion(stand_in, seconds=2.0):
+    """Convert the same JSON subtitle to SRT for a while, in this process."""
+    sys.path.insert(0, SRC)
+    import tedcommon
+    payload = stand_in.subtitle('eng')
+    folder = tempfile.mkdtemp(prefix='srt-')
+    sub = os.path.join(folder, 'talk.eng.srt')
+    conversions = 0
+    start = time.time()
+    try:
+        while time.time() - start < seconds:
+            tedcommon.write_srt(sub, json.loads(payload)['captions'], 12820.0)
+            conversions += 1
+    finally:
+        shutil.rmtree(folder)
+    elapsed = time.time() - start
+    return {'captions': stand_in.captions, 'conversions': conversions,
+            'conversions_per_sec': conversions / elapsed}
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="End to end throughput of TEDTalks.py"
+                            " & TEDSubs.py against a local stand-in of TED")
+    parser.add_argument("-n", "--talks", type=int, default=10,
+                        help="number of talks in the feed")
+    parser.add_argument("-s", "--video-size", type=int, default=8 * 2 ** 20,
+                        help="bytes of every video")
+    parser.add_argument("-l", "--latency", type=float, default=20,
+                        help="milliseconds to wait before every response")
+    parser.add_argument("-b", "--bandwidth", type=float, default=0,
+                        help="KiB per second of every connection (0, no "
+                        "limit)")
+    parser.add_argument("-c", "--captions", type=int, default=200,
+                        help="number of captions of every subtitle")
+    parser.add_argument("-t", "--capacity", type=int, default=0,
+                        help="requests served at the same time by the "
+                        "stand-in, the rest are throttled (0, no limit)")
+    parser.add_argument("-j", "--json", metavar="FILE",
+                        help="save the results as JSON in this file")
+    parser.add_argument("extra", nargs='*', metavar="ARG",
+                        help="extra arguments for TEDTalks.py (after --)")
+    args = parser.parse_args()
+
+    stand_in = tedserver.TEDStandIn(args.talks, args.video_size,
+                                    args.latency / 1000.0,
+                                    args.bandwidth * 1024,
+                                    captions=args.captions,
+                                    capacity=args.capacity)
+    port = stand_in.start()
+    try:
+        results = {'TEDTalks': bench_tedtalks(stand_in, port, args),
+                   'TEDSubs': bench_tedsubs(stand_in, port, args),
+                   'TEDSubs -b': bench_tedsubs(stand_in, port, args, True),
+                   'conversion': bench_conversion(stand_in),
+                   'requests': stand_in.requests}
+    finally:
+        stand_in.stop()
+
+    for script in ('TEDTalks', 'TEDSubs', 'TEDSubs -b'):
+        result = results[script]
+        print('{0:<10} {1:3d} talks {2:8.2f} s {3:8.1f} talks/min '
+              '{4:8.2f} MB/s  peak RSS {5:7d} KiB'.
+              format(script, result['talks'], result['seconds'],
+                     result['talks_per_min'], result['mb_per_sec'],
+                     result['peak_rss_kib']))
+    print('SRT        {0:8.1f} conversions/s ({1} captions each)'.
+          format(results['conversion']['conversions_per_sec'],
+                 results['conversion']['captions']))
+    requests = sorted(results['requests'].items())
+    print('Requests   {0}'.format(', '.join('{0}: {1}'.format(kind, count)
+                                            for kind, count in requests)))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
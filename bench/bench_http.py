@@ -0,0 +1,118 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    bench_http.py: Compare the ways to fetch small resources (requests/sec)
+"""
+
+#==============================================================================
+# Serves a small JSON document (like a TED subtitle) from a local keep-alive
+# HTTP server and measures the requests per second of each way of fetching
+# it: a wget process per request (the old path), urllib2 (a connection per
+# request) and the pool of connections of the scripts (tedcommon.HTTPPool).
+#
+#   python bench_http.py [-n REQUESTS] [-s SIZE] [-l LATENCY]
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import os
+import sys
+import threading
+import time
+import urllib2
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from subprocess import Popen, PIPE
+
+# the requests go straight to the local server, never through a proxy
+for variable in ('http_proxy', 'HTTP_PROXY'):
+    os.environ.pop(variable, None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+import tedcommon
+
+
+def serve(size, latency):
+    """Start a local keep-alive server in a thread, return it and its url.
+
+    Every new connection waits 'latency' seconds before being served, as the
+    DNS lookup and the TCP handshake with a remote server would do.
+
+    """
+    body = '{"captions": [' + 'x' * max(0, size - 16) + ']}'
+
+    class Handler(BaseHTTPRequestHandler):
+        """Answer every GET with the same body."""
+        protocol_version = 'HTTP/1.1'
+        # one send per response, like the real web servers
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            time.sleep(latency)
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    worker = threading.Thread(target=server.serve_forever)
+    worker.daemon = True
+    worker.start()
+    return server, 'http://127.0.0.1:{0}/subtitles'.format(server.server_port)
+
+
+def measure(name, fetch, url, requests):
+    """Fetch the url a number of times and print the requests per second."""
+    start = time.time()
+    for _ in range(requests):
+        fetch(url)
+    elapsed = time.time() - start
+    print('{0:<10} {1:>6} requests {2:8.3f} s {3:10.1f} req/s'.
+          format(name, requests, elapsed, requests / elapsed))
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="Compare the ways to fetch small "
+                            "resources from a local HTTP server")
+    parser.add_argument("-n", "--requests", type=int, default=500,
+                        help="requests made by each way")
+    parser.add_argument("-s", "--size", type=int, default=20000,
+                        help="bytes of the document served")
+    parser.add_argument("-l", "--latency", type=float, default=10,
+                        help="milliseconds to open a connection")
+    args = parser.parse_args()
+    server, url = serve(args.size, args.latency / 1000.0)
+    measure('wget', lambda link: Popen(['wget', '-q', '-O', '-', link],
+                                       stdout=PIPE).communicate()[0],
+            url, args.requests)
+    measure('urllib2', lambda link: urllib2.urlopen(link).read(),
+            url, args.requests)
+    measure('pool', tedcommon.HTTPPool().read, url, args.requests)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    bench_scraper.py: Time to read the values of a talk from its web page
+"""
+
+#==============================================================================
+# Compares, on large web pages of talks, the way to read a talk's values of
+# the previous versions (the whole page read, then four regexes over it) with
+# the one of the scripts now (tedcommon.scrape_page, the page read by chunks
+# only until the talk's JSON object, decoded at once). Reports the best and
+# the median milliseconds of each and the bytes of the page that they read.
+#
+# The pages are made like the ones of tedserver.py, with their HTML on many
+# lines or on a single one (as TED's minified pages), or read from files:
+#
+#   python bench_scraper.py [-s PAGE_SIZE] [-r RUNS] [FILE [FILE ...]]
+#
+# Use -j FILE to save the results as JSON and compare them between versions.
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import json
+import os
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from cStringIO import StringIO
+
+import tedserver
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+import tedcommon
+
+# the regexes of the previous versions
+REGEX_INTRO = re.compile('"introDuration":(\d+\.?\d+),')
+REGEX_ID = re.compile('"id":(\d+),')
+REGEX_URL = re.compile('"nativeDownloads":.*"high":"(.+)\?.+},"sub')
+REGEX_VID = re.compile('http://.+\/(.*\.mp4)')
+
+
+class CountingFile():
+    """A page in memory that counts the bytes read from it."""
+
+    def __init__(self, page):
+        self.page = StringIO(page)
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.page.read(size)
+        self.size += len(data)
+        return data
+
+
+def regexes(page_file):
+    """The values of the talk as the previous versions read them."""
+    page = page_file.read()
+    intro = (float(REGEX_INTRO.findall(page)[0]) + 1) * 1000
+    talk = int(REGEX_ID.findall(page)[0])
+    url = REGEX_URL.findall(page)[0]
+    REGEX_VID.findall(url)[0]
+    return talk, intro, url
+
+
+def stream(page_file):
+    """The values of the talk as the scripts read them now."""
+    values = tedcommon.scrape_page(page_file, 'bench')
+    return values['id'], values['intro'], values['urls']['high']
+
+
+def measure(extract, page, runs):
+    """Extract the values of a page several times, return the best & median
+    milliseconds and the bytes read."""
+    times = []
+    for _ in range(runs):
+        page_file = CountingFile(page)
+        start = time.time()
+        extract(page_file)
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return {'best_ms': times[0], 'median_ms': times[len(times) // 2],
+            'bytes_read': page_file.size}
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="Time to read the values of a talk "
+                            "from its web page, regexes vs. streaming")
+    parser.add_argument("-s", "--page-size", type=int, default=4 * 2 ** 20,
+                        help="bytes of the pages made (default: 4 MiB)")
+    parser.add_argument("-r", "--runs", type=int, default=20,
+                        help="times that every page is read")
+    parser.add_argument("-j", "--json", metavar="FILE",
+                        help="save the results as JSON in this file")
+    parser.add_argument("pages", nargs='*', metavar="FILE",
+                        help="saved web pages of talks, instead of the made "
+                        "ones")
+    args = parser.parse_args()
+
+    pages = []
+    for name in args.pages:
+        with open(name, 'rb') as page_file:
+            pages.append((os.path.basename(name), page_file.read()))
+    if not pages:
+        page = tedserver.TEDStandIn(1, page_size=args.page_size).page(0)
+        pages = [('lines', page), ('one line', page.replace('\n', ''))]
+
+    results = {}
+    for name, page in pages:
+        results[name] = {'size': len(page)}
+        for way, extract in (('regexes', regexes), ('stream', stream)):
+            results[name][way] = measure(extract, page, args.runs)
+    for name, _ in pages:
+        result = results[name]
+        for way in ('regexes', 'stream'):
+            print('{0:<12} {1:<8} best {2:9.2f} ms  median {3:9.2f} ms  '
+                  'read {4:9d} of {5:9d} bytes'.
+                  format(name[:12], way, result[way]['best_ms'],
+                         result[way]['median_ms'],
+                         result[way]['bytes_read'], result['size']))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    bench_startup.py: Start up time of TEDTalks.py & TEDSubs.py
+"""
+
+#==============================================================================
+# The scripts are run very often (e.g. TEDTalks.py by cron, and most times
+# there is nothing new), so the time of a run that has nothing to do matters.
+# Runs every case several times against a local stand-in of the TED servers
+# (tedserver.py) and reports the best and the median milliseconds of each:
+#
+#  - the python interpreter alone, as the baseline
+#  - the version and the help of both scripts
+#  - TEDTalks.py when the feed hasn't changed (a 304) and when the feed read
+#    the last time is still fresh (its Cache-Control), so it's not asked for
+#  - TEDSubs.py with a talk already downloaded
+#
+#   python bench_startup.py [-r RUNS]
+#
+# Use -j FILE to save the results as JSON and compare them between versions.
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import json
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+
+import tedserver
+from bench_e2e import run
+
+
+def measure(script, args, cwd, port, runs):
+    """Run a script several times, return the best & median milliseconds."""
+    times = sorted(run(script, args, cwd, port)[0] * 1000
+                   for _ in range(runs))
+    return {'best_ms': times[0], 'median_ms': times[len(times) // 2]}
+
+
+def baseline(runs):
+    """The milliseconds of the python interpreter alone."""
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        Popen([sys.executable, '-c', 'pass'], stdout=PIPE).communicate()
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return {'best_ms': times[0], 'median_ms': times[len(times) // 2]}
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="Start up time of TEDTalks.py & "
+                            "TEDSubs.py when they have nothing to do")
+    parser.add_argument("-r", "--runs", type=int, default=20,
+                        help="times that every case is run")
+    parser.add_argument("-j", "--json", metavar="FILE",
+                        help="save the results as JSON in this file")
+    args = parser.parse_args()
+
+    stand_in = tedserver.TEDStandIn(2, 10000, captions=10)
+    port = stand_in.start()
+    folder = tempfile.mkdtemp(prefix='startup-')
+    url = '{0}/Speaker0.html'.format(tedserver.TALKS_URL)
+    results = {}
+    try:
+        results['python'] = baseline(args.runs)
+        for script in ('TEDTalks.py', 'TEDSubs.py'):
+            results[script + ' --version'] = measure(script, ['--version'],
+                                                     folder, port, args.runs)
+            results[script + ' --help'] = measure(script, ['--help'], folder,
+                                                  port, args.runs)
+        # Download all first, then the feed is always the same
+        run('TEDTalks.py', ['--no-mail'], folder, port)
+        results['TEDTalks.py (304)'] = measure('TEDTalks.py', ['--no-mail'],
+                                               folder, port, args.runs)
+        stand_in.max_age = 3600
+        run('TEDTalks.py', ['--no-mail'], folder, port)
+        results['TEDTalks.py (fresh)'] = measure('TEDTalks.py', ['--no-mail'],
+                                                 folder, port, args.runs)
+        run('TEDSubs.py', [url], folder, port)
+        results['TEDSubs.py (done)'] = measure('TEDSubs.py', [url], folder,
+                                               port, args.runs)
+    finally:
+        stand_in.stop()
+        shutil.rmtree(folder)
+    results['requests'] = stand_in.requests
+
+    for case in ('python', 'TEDTalks.py --version', 'TEDTalks.py --help',
+                 'TEDTalks.py (304)', 'TEDTalks.py (fresh)',
+                 'TEDSubs.py --version', 'TEDSubs.py --help',
+                 'TEDSubs.py (done)'):
+        print('{0:<24} best {1:7.1f} ms  median {2:7.1f} ms'.
+              format(case, results[case]['best_ms'],
+                     results[case]['median_ms']))
+    requests = sorted(results['requests'].items())
+    print('Requests   {0}'.format(', '.join('{0}: {1}'.format(kind, count)
+                                            for kind, count in requests)))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
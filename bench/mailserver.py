@@ -0,0 +1,117 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    mailserver.py: A local stand-in of a mail server to try the mails
+"""
+
+#==============================================================================
+# A SMTP server that takes every mail and prints its subject and size (and,
+# with -o, saves it to a folder), and the sessions opened, to see how many
+# mails go by every session. It can also be slow (-d, seconds to wait before
+# taking every mail) or dead (-m, the connections are accepted but never
+# answered), to see that the downloads don't wait for the mails:
+#
+#   python mailserver.py [-p PORT] [-d DELAY] [-m] [-o FOLDER]
+#
+# and run the scripts with '--mail-server localhost:PORT'.
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncore
+import email
+import os
+import smtpd
+import sys
+import time
+from argparse import ArgumentParser
+
+
+class MailStandIn(smtpd.SMTPServer):
+    """
+
+    The stand-in of a mail server, served by asyncore.loop().
+
+    """
+
+    def __init__(self, port=2525, delay=0, mute=False, folder=None):
+        """Create the stand-in.
+
+        (int) port -- the port to listen to
+        (float) delay -- seconds to wait before taking every mail
+        (bool) mute -- accept the connections but never answer them
+        (str) folder -- the folder to save the mails (None, not saved)
+
+        """
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', port), None)
+        self.delay = delay
+        self.mute = mute
+        self.folder = folder
+        self.sessions = 0
+        self.mails = 0
+        self.__muted = []
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        self.sessions += 1
+        self.log('session {0} from {1}'.format(self.sessions, pair[1][0]))
+        if self.mute:
+            self.__muted.append(pair[0])
+        else:
+            smtpd.SMTPChannel(self, *pair)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        time.sleep(self.delay)
+        self.mails += 1
+        subject = email.message_from_string(data)['Subject']
+        self.log('mail {0} ({1} bytes) to {2}: {3}'.format(
+            self.mails, len(data), ', '.join(rcpttos), subject))
+        if self.folder:
+            with open(os.path.join(self.folder, '{0:04d}.eml'.
+                                   format(self.mails)), 'w') as mail_file:
+                mail_file.write(data)
+
+    def log(self, message):
+        """Print a message with the time."""
+        print('{0} {1}'.format(time.strftime('%X'), message))
+        sys.stdout.flush()
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="A local stand-in of a mail server")
+    parser.add_argument("-p", "--port", type=int, default=2525,
+                        help="the port to listen to")
+    parser.add_argument("-d", "--delay", type=float, default=0,
+                        help="seconds to wait before taking every mail")
+    parser.add_argument("-m", "--mute", action="store_true",
+                        help="accept the connections but never answer them")
+    parser.add_argument("-o", "--output", metavar="FOLDER",
+                        help="save the mails to this folder")
+    args = parser.parse_args()
+    MailStandIn(args.port, args.delay, args.mute, args.output)
+    print('Serving at smtp://127.0.0.1:{0}'.format(args.port))
+    try:
+        asyncore.loop()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    tedserver.py: A local stand-in of the TED web servers for the benchmarks
+"""
+
+#==============================================================================
+# Serves a synthetic TED Talks HD RSS feed with N talks, their web pages (with
+# the id, published, introDuration & nativeDownloads values, and also by id,
+# from 1 to N), their subtitles in JSON and fake MP4 videos (with support for
+# Range requests, the web page's smaller variants of a quarter and a half of
+# the feed's video size for 'low' & 'medium'). The latency of every response
+# and the bandwidth of every connection can be limited.
+#
+# The server also works as a HTTP proxy, so the scripts can be pointed to it
+# without changes, only with the environment variable:
+#
+#   http_proxy=http://127.0.0.1:PORT python TEDTalks.py
+#
+# Run it alone with:
+#
+#   python tedserver.py [-p PORT] [-n TALKS] [-s VIDEO_SIZE] ...
+#==============================================================================
+
+#==============================================================================
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import json
+import re
+import socket
+import sys
+import threading
+import time
+import urlparse
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from email.utils import formatdate
+
+FEED_URL = 'http://feeds.feedburner.com/tedtalksHD'
+TALKS_URL = 'http://www.ted.com/talks'
+VIDEOS_URL = 'http://video.ted.com/talks/podcast'
+DOWNLOADS_URL = 'http://download.ted.com/talks'
+
+# the bytes of the fake videos, repeated until their size
+PATTERN = ''.join(chr(byte) for byte in range(256)) * 256
+
+# the divisor of the video size by the suffix of the video's name (variant)
+VARIANTS = {'-light': 4, '': 2, '-480p': 1, '_480': 1}
+
+ITEM = """<item>
+<title>{title}</title>
+<itunes:subtitle>{title}</itunes:subtitle>
+<itunes:duration>00:{mins:02d}:00</itunes:duration>
+<guid isPermaLink="false">eng.video.talk.ted.com:{id}</guid>
+<description>{summary}</description>
+<content:encoded>{summary}</content:encoded>
+<pubDate>{published}</pubDate>
+<media:content url="{videos}/{name}_480.mp4?apikey=TEDRSS" fileSize="{size}"
+ type="video/mp4"/>
+<feedburner:origLink>{talks}/{name}.html</feedburner:origLink>
+</item>
+"""
+
+FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"
+ xmlns:media="http://search.yahoo.com/mrss/"
+ xmlns:content="http://purl.org/rss/1.0/modules/content/"
+ xmlns:feedburner="http://rssnamespace.org/feedburner/ext/1.0">
+<channel>
+<title>TEDTalks (hd)</title>
+<link>http://www.ted.com/talks/list</link>
+<description>A stand-in of the TED Talks HD feed</description>
+{items}</channel>
+</rss>
+"""
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>{title}</title></head><body>
+{padding}
+<script>var talkDetails = {{"id":{id},"name":"{title}","published":{published},"introDuration":11.82,"nativeDownloads":{{"low":"{downloads}/{name}-light.mp4?apikey=TEDDOWNLOAD","medium":"{downloads}/{name}.mp4?apikey=TEDDOWNLOAD","high":"{downloads}/{name}-480p.mp4?apikey=TEDDOWNLOAD"}},"subtitleDownload":{{"available":true}}}};</script>
+{padding}
+</body></html>
+"""
+
+
+class TEDStandIn():
+    """
+
+    The stand-in of the TED servers, running in its own threads.
+
+    """
+
+    def __init__(self, talks=10, video_size=2 ** 20, latency=0, bandwidth=0,
+                 languages=('eng', 'spa'), captions=100, page_size=100000,
+                 max_age=0, capacity=0):
+        """Create the stand-in.
+
+        (int) talks -- number of talks in the feed
+        (int) video_size -- bytes of every video
+        (float) latency -- seconds to wait before every response
+        (float) bandwidth -- bytes per second of every connection (0, no limit)
+        (iterable) languages -- languages of the subtitles available
+        (int) captions -- number of captions of every subtitle
+        (int) page_size -- approximate bytes of every talk's web page
+        (int) max_age -- seconds that the feed is fresh (Cache-Control), 0
+                         to not send it
+        (int) capacity -- requests served at the same time, the rest are
+                          throttled (0, no limit): a 429 status, or a TED's
+                          error message for the subtitles
+
+        """
+        self.talks = talks
+        self.video_size = video_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.languages = set(languages)
+        self.captions = captions
+        self.page_size = page_size
+        self.max_age = max_age
+        self.capacity = capacity
+        self.active = 0
+        self.now = time.time()
+        self.requests = {}
+        self.sent = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def count(self, kind):
+        """Count a request of a kind (feed, page, subtitle, video...)."""
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def count_sent(self, name, size):
+        """Count the bytes of a video sent (to see if it's downloaded more
+        than once)."""
+        with self.lock:
+            self.sent[name] = self.sent.get(name, 0) + size
+
+    def feed(self):
+        """The RSS feed, the newest talk first."""
+        items = []
+        for idx in range(self.talks):
+            published = formatdate(self.now - 60 * (idx + 1))
+            items.append(ITEM.format(title='Talk {0}'.format(idx),
+                                     mins=idx % 60, id=self.talks - idx,
+                                     summary='The talk number {0}'.
+                                     format(idx),
+                                     published=published, videos=VIDEOS_URL,
+                                     talks=TALKS_URL,
+                                     name='Speaker{0}'.format(idx),
+                                     size=self.video_size))
+        return FEED.format(items=''.join(items))
+
+    def page(self, idx):
+        """The web page of a talk."""
+        padding = '<p>{0}</p>'.format('x' * max(0, self.page_size // 2))
+        return PAGE.format(title='Talk {0}'.format(idx), id=self.talks - idx,
+                           name='Speaker{0}'.format(idx), padding=padding,
+                           downloads=DOWNLOADS_URL,
+                           published=int(self.now - 60 * (idx + 1)))
+
+    def subtitle(self, lang):
+        """A subtitle in the TED's JSON format, or its error message."""
+        if lang not in self.languages:
+            return json.dumps({'status': {'message': 'Not Found',
+                                          'code': 404}})
+        captions = [{'content': u'Caption {0} in {1} ñ'.format(idx, lang),
+                     'startTime': idx * 4000, 'duration': 3500,
+                     'startOfParagraph': not idx % 5}
+                    for idx in range(self.captions)]
+        return json.dumps({'captions': captions})
+
+    def start(self, port=0):
+        """Start serving in a thread. Returns the port."""
+        stand_in = self
+
+        class Handler(StandInHandler):
+            """A request handler bound to this stand-in."""
+            ted = stand_in
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        worker = threading.Thread(target=self.server.serve_forever)
+        worker.daemon = True
+        worker.start()
+        return self.server.server_port
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """A HTTP server with a thread per connection."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        """Ignore the clients that close the connection before the end of a
+        response (e.g. when they stop reading the feed), report the rest."""
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+
+    Answer the requests as the TED servers would do.
+
+    """
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    ted = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        # The requests are being served while they wait for the latency
+        with self.ted.lock:
+            self.ted.active += 1
+            busy = self.ted.capacity and self.ted.active > self.ted.capacity
+        time.sleep(self.ted.latency)
+        with self.ted.lock:
+            self.ted.active -= 1
+        path = urlparse.urlsplit(self.path).path
+        subtitle = re.search(r'/subtitles/id/(\d+)/lang/(\w+)', path)
+        if busy:
+            self.ted.count('throttled')
+            if subtitle:
+                self.reply(200, json.dumps({'status': {
+                    'message': 'Too Many Requests', 'code': 429}}),
+                    'application/json', head)
+            else:
+                self.reply(429, 'Too Many Requests', 'text/plain', head)
+            return
+        page = re.search(r'/talks/Speaker(\d+)\.html$', path)
+        talk_id = re.search(r'/talks/view/id/(\d+)$', path)
+        video = re.search(r'/Speaker(\d+)(-light|-480p|_480|)\.mp4$', path)
+        if path.endswith('/tedtalksHD'):
+            self.ted.count('feed')
+            etag = '"{0}-{1}"'.format(self.ted.talks, int(self.ted.now))
+            max_age = self.ted.max_age or None
+            if self.headers.getheader('If-None-Match') == etag:
+                self.reply(304, '', head=True, etag=etag, max_age=max_age)
+            else:
+                self.reply(200, self.ted.feed(), 'application/rss+xml', head,
+                           etag=etag, max_age=max_age)
+        elif subtitle:
+            self.ted.count('subtitle')
+            self.reply(200, self.ted.subtitle(subtitle.group(2)),
+                       'application/json', head)
+        elif talk_id:
+            # The talks' ids go from 1 (the oldest) to the number of talks
+            self.ted.count('talk id')
+            idx = self.ted.talks - int(talk_id.group(1))
+            if 0 <= idx < self.ted.talks:
+                self.send_response(301)
+                self.send_header('Location', '{0}/Speaker{1}.html'.
+                                 format(TALKS_URL, idx))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.reply(404, 'Not Found', 'text/plain', head)
+        elif page:
+            self.ted.count('page')
+            self.reply(200, self.ted.page(int(page.group(1))), 'text/html',
+                       head)
+        elif video:
+            self.ted.count('video')
+            self.video(head, self.ted.video_size //
+                       VARIANTS[video.group(2)], path.split('/')[-1])
+        else:
+            self.reply(404, 'Not Found', 'text/plain', head)
+
+    def reply(self, code, body, ctype='text/html', head=False, etag=None,
+              max_age=None):
+        """Send a whole response."""
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        if max_age:
+            self.send_header('Cache-Control', 'max-age={0}'.format(max_age))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def video(self, head, size, name):
+        """Send a fake video of some bytes, or the range of it asked for."""
+        start, end = 0, size - 1
+        ranged = re.match(r'bytes=(\d+)-(\d*)$',
+                          self.headers.getheader('Range') or '')
+        if ranged:
+            start = int(ranged.group(1))
+            end = min(int(ranged.group(2) or end), end)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes {0}-{1}/{2}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if head:
+            return
+        self.wfile.flush()
+        chunk_size = len(PATTERN)
+        began = time.time()
+        sent = 0
+        while start <= end:
+            offset = start % chunk_size
+            chunk = PATTERN[offset:offset + min(chunk_size - offset,
+                                                end - start + 1)]
+            # Counted before it's sent, the client may end as soon as it
+            # has the last byte
+            self.ted.count_sent(name, len(chunk))
+            self.wfile.write(chunk)
+            start += len(chunk)
+            sent += len(chunk)
+            if self.ted.bandwidth:
+                ahead = sent / float(self.ted.bandwidth) - (time.time() -
+                                                            began)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+def main():
+    """main section"""
+    parser = ArgumentParser(description="A local stand-in of the TED web "
+                            "servers, it works as a HTTP proxy too")
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="the port to listen to")
+    parser.add_argument("-n", "--talks", type=int, default=10,
+                        help="number of talks in the feed")
+    parser.add_argument("-s", "--video-size", type=int, default=2 ** 20,
+                        help="bytes of every video")
+    parser.add_argument("-l", "--latency", type=float, default=0,
+                        help="milliseconds to wait before every response")
+    parser.add_argument("-b", "--bandwidth", type=float, default=0,
+                        help="KiB per second of every connection")
+    parser.add_argument("-a", "--max-age", type=int, default=0,
+                        help="seconds that the feed is fresh (0, no "
+                        "Cache-Control header)")
+    parser.add_argument("-c", "--capacity", type=int, default=0,
+                        help="requests served at the same time, the rest "
+                        "are throttled (0, no limit)")
+    args = parser.parse_args()
+    stand_in = TEDStandIn(args.talks, args.video_size, args.latency / 1000.0,
+                          args.bandwidth * 1024, max_age=args.max_age,
+                          capacity=args.capacity)
+    print('Serving at http://127.0.0.1:{0}'.format(stand_in.start(args.port)))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stand_in.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -33,15 +33,14 @@ __date__ = "08/11/2012"
 __version__ = "1.7"
 
 try:
-    import json
     import os
     import optparse
-    import platform
+    import Queue
     import re
     import sys
-    import urllib
-    import urllib2
-    from subprocess import Popen, PIPE
+    import threading
+    from tedcommon import (CHUNK_SIZE, HTTP, LazyModule, ScrapeError,
+                           TalkCache, get_sub, parse_size, read_page)
 except ImportError:
     # Checks the installation of the necessary python modules
     print((os.linesep * 2).join(["An error found importing one module:",
@@ -49,11 +48,127 @@ except ImportError:
     sys.exit(-2)
 
 
+httplib = LazyModule('httplib')
+subprocess = LazyModule('subprocess')
+urllib2 = LazyModule('urllib2')
+
+# regex expression of the name of a talk's video in its url
+REGEX_VID = re.compile('http://.+\/(.*\.mp4)')
+# the qualities of the videos in a talk's web page, the best first
+QUALITIES = ('high', 'medium', 'low')
+
+
+class QualityPolicy():
+    """
+
+    Choice of the variant (quality) of every video downloaded.
+
+    The variants of a talk are the ones of its web page, see QUALITIES. The
+    preferred one is chosen if it's available and fits, if not, the lower ones
+    in order, then the higher ones. A variant fits if it's not larger than the
+    bytes by talk and the bytes left of the run's budget, its size asked for
+    by a HEAD request. The video keeps the name of the 'high' one.
+
+    An interrupted video is resumed in the same variant, the one in its
+    '<video>.part.variant' file (if it's not the 'high' one).
+
+    """
+
+    def __init__(self, quality='high', max_size=0, budget=0):
+        """Set the policy.
+
+        (str) quality -- the preferred quality, see QUALITIES
+        (int) max_size -- the bytes of a video at most, 0 is no limit
+        (int) budget -- the bytes of the videos of a run at most, 0 is no limit
+
+        """
+        self.quality = quality
+        self.max_size = max_size
+        self.budget = budget
+        self.spent = 0
+        self.__lock = threading.Lock()
+
+    def order(self):
+        """The qualities in the order they are tried."""
+        idx = QUALITIES.index(self.quality)
+        return QUALITIES[idx:] + QUALITIES[:idx][::-1]
+
+    def choose(self, talk, vid_name, cache):
+        """Choose the variant of a talk's video and take its bytes from the
+        budget.
+
+        (dict) talk -- the talk's values, see talk_values()
+        (str) vid_name -- the name of the talk's video
+        (TalkCache) cache -- the talks' values, the talk is dropped from it if
+                             no variant is chosen
+
+        Returns the quality, the url and the size (None if the server hides
+        it) of the variant, or None if none fits in the budget. Raises an
+        IOError if none is available or fits in the bytes by talk.
+
+        """
+        part_name = '{0}.part'.format(vid_name)
+        variant_name = '{0}.variant'.format(part_name)
+        qualities = [quality for quality in self.order()
+                     if talk['urls'].get(quality)]
+        # An interrupted video goes on in its variant, if it still fits
+        part_quality = None
+        if os.path.exists(part_name):
+            part_quality = 'high'
+            if os.path.exists(variant_name):
+                with open(variant_name) as variant_file:
+                    part_quality = variant_file.read().strip()
+            if part_quality in qualities:
+                qualities.remove(part_quality)
+                qualities.insert(0, part_quality)
+        over_budget = False
+        for quality in qualities:
+            try:
+                size = remote_size(talk['urls'][quality])
+            except (IOError, httplib.HTTPException):
+                continue
+            if self.max_size and (size is None or size > self.max_size):
+                continue
+            resumed = (os.path.getsize(part_name) if quality == part_quality
+                       else 0)
+            with self.__lock:
+                if self.budget and (size is None or
+                                    self.spent + size - resumed >
+                                    self.budget):
+                    over_budget = True
+                    continue
+                self.spent += (size or 0) - resumed
+            if part_quality is not None and quality != part_quality:
+                # The bytes of another variant are useless, start over
+                os.remove(part_name)
+            if quality != 'high':
+                with open(variant_name, 'w') as variant_file:
+                    variant_file.write(quality)
+            elif os.path.exists(variant_name):
+                os.remove(variant_name)
+            return quality, talk['urls'][quality], size
+        if over_budget:
+            return None
+        # The urls kept of the talk's page may be stale, the next run reads
+        # it again
+        cache.invalidate(talk['page'])
+        if self.max_size:
+            raise IOError('No variant of the video {0} fits in {1} bytes'.
+                          format(vid_name, self.max_size))
+        raise IOError('No variant of the video {0} is available'.
+                      format(vid_name))
+
+
+# the quality policy of the videos, set by the options
+QUALITY = QualityPolicy()
+
+
 def options():
     """Defines the command line arguments and options for the script."""
-    usage = """usage: %prog [Options] TEDTalkURL
+    usage = """usage: %prog [Options] TEDTalkURL [TEDTalkURL ...]
 
-    Where TEDTalkURL is the url of a TED Talk webpage
+    Where TEDTalkURL is the url of a TED Talk webpage, with several urls (or
+    the -b option) the talks are downloaded in batch mode, some at a time
 
     For example:
 
@@ -69,6 +184,34 @@ def options():
                       dest="no_video",
                       help="download only the subs, not the video ",
                       default=False)
+    parser.add_option("-l", "--languages", dest="languages",
+                      default="eng,spa", metavar="LANGS",
+                      help="comma separated languages of the subtitles "
+                      "(default: eng,spa)")
+
+    parser.add_option("-b", "--batch", dest="batch", metavar="FILE",
+                      help="read the talks' urls from a file, one per line "
+                      "('-' for the standard input)")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+                      metavar="N", help="number of talks whose pages and "
+                      "subtitles are downloaded at the same time in batch "
+                      "mode (default: 4)")
+    parser.add_option("-V", "--video-jobs", dest="video_jobs", type="int",
+                      default=2, metavar="N", help="number of videos "
+                      "downloaded at the same time in batch mode (default: 2)")
+
+    parser.add_option("-Q", "--quality", dest="quality", type="choice",
+                      choices=list(QUALITIES), default="high",
+                      help="preferred quality of the videos, the next lower "
+                      "ones if it's missing or doesn't fit, one of: {0} "
+                      "(default: high)".format(', '.join(QUALITIES)))
+    parser.add_option("--max-size", dest="max_size", default="0",
+                      metavar="SIZE", help="bytes of a video at most, like "
+                      "200M (default: 0, no limit)")
+    parser.add_option("--budget", dest="budget", default="0", metavar="SIZE",
+                      help="bytes of the videos of a run at most, like 2G, "
+                      "the rest are left for the next run (default: 0, no "
+                      "limit)")
 
     return parser
 
@@ -76,149 +219,321 @@ def options():
 def check_exec_posix(prog):
     """Check if the program is installed in a *NIX platform.
 
+    Looks for it in the folders of the PATH, as the shell does, instead of
+    running it (that takes more than all the rest of the start up).
+
     Returns one value:
 
     (boolean) found - True if the program is installed
 
     """
-    found = True
-    try:
-        Popen([prog, '--help'], stdout=PIPE, stderr=PIPE)
-    except OSError:
-        found = False
-    return found
-
-
-def get_sub(tt_id, tt_intro, sub):
-    """Get TED Subtitle in JSON format & convert it to SRT Subtitle."""
-
-    def srt_time(tst):
-        """Format Time from TED Subtitles format to SRT time Format."""
-        secs, mins, hours = ((tst / 1000) % 60), (tst / 60000), (tst / 3600000)
-        right_srt_time = ("{0:02d}:{1:02d}:{2:02d},{3:3.0f}".
-                          format(int(hours), int(mins), int(secs),
-                                 divmod(secs, 1)[1] * 1000))
-        return right_srt_time
-
-    srt_content = ''
-    tt_url = 'http://www.ted.com/talks'
-    sub_url = '{0}/subtitles/id/{1}/lang/{2}'.format(tt_url, tt_id, sub[-7:-4])
-    # Get JSON sub
-    if FOUND:
-        json_file = Popen(['wget', '-q', '-O', '-', sub_url],
-                          stdout=PIPE).stdout.readlines()
+    for folder in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(folder or os.curdir, prog)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return True
+    return False
 
-        if json_file:
-            for line in json_file:
-                if line.find('captions') == -1 and line.find('status') == -1:
-                    json_file.remove(line)
-        else:
-            print("Subtitle '{0}' not found.".format(sub))
-    else:
-        json_file = urllib2.urlopen(sub_url).readlines()
-    if json_file:
-        try:
-            json_object = json.loads(json_file[0])
-            if 'captions' in json_object:
-                caption_idx = 1
-                if not json_object['captions']:
-                    print("Subtitle '{0}' not available.".format(sub))
-                for caption in json_object['captions']:
-                    start = tt_intro + caption['startTime']
-                    end = start + caption['duration']
-                    idx_line = '{0}'.format(caption_idx)
-                    time_line = '{0} --> {1}'.format(srt_time(start),
-                                                     srt_time(end))
-                    text_line = '{0}'.format(caption['content'].
-                                             encode("utf-8"))
-                    srt_content += '\n'.join([idx_line, time_line, text_line,
-                                              '\n'])
-                    caption_idx += 1
-            elif 'status' in json_object:
-                print("This is an error message returned by TED:{0}{0} - "
-                      "{1}{0}{0}Probably because the subtitle '{2}' is not "
-                      "available.{0}".format(os.linesep,
-                                             json_object['status']['message'],
-                                             sub))
-        except ValueError:
-            print("Subtitle '{0}' it's a malformed json file.".format(sub))
-    return srt_content
-
-
-def check_subs(tt_id, tt_intro, tt_video):
+
+def check_subs(tt_id, tt_intro, tt_video, langs, cache):
     """Check if the subtitles for the talk exists and try to get them. Checks
-    it for english and spanish languages."""
-    # Get the names for the subtitles (for english and spanish languages) only
-    # if they not are already downloaded
-    subs = ("{0}.{1}.srt".format(tt_video[:-4], lang) for lang in
-            ('eng', 'spa'))
-    for sub in subs:
-        subtitle = get_sub(tt_id, tt_intro, sub)
-        if subtitle:
-            with open(sub, 'w') as srt_file:
-                srt_file.write(subtitle)
-            print("Subtitle '{0}' downloaded.".format(sub))
-    return
-
-
-def get_video(vid_name, vid_url):
-    """Gets the TED Talk video."""
-    print("Donwloading video...")
+    it for the languages given, all of them at the same time.
+
+    The languages that TED reports as not available are recorded in the
+    cache, so they aren't asked for again until the talk's entry expires.
+    Returns the messages of the subtitles, in the order of the languages.
+
+    The subtitles already downloaded are skipped.
+
+    """
+    talk = cache.get(tt_id) or {}
+    subs = [(lang, "{0}.{1}.srt".format(tt_video[:-4], lang)) for lang in
+            langs if lang not in talk.get('unavailable', ())]
+    subs = [(lang, sub) for lang, sub in subs if not os.path.exists(sub)]
+    results = [('error', '')] * len(subs)
+
+    def fetch(idx, lang, sub):
+        """Get a subtitle, storing its result in its place of the results."""
+        results[idx] = get_sub(tt_id, tt_intro, lang, sub)
+
+    workers = [threading.Thread(target=fetch, args=(idx, lang, sub))
+               for idx, (lang, sub) in enumerate(subs)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    messages, unavailable = [], []
+    for (lang, sub), (result, message) in zip(subs, results):
+        if message:
+            messages.append(message)
+        if result == 'downloaded':
+            messages.append("Subtitle '{0}' downloaded.".format(sub))
+        elif result == 'unavailable':
+            unavailable.append(lang)
+    if unavailable:
+        cache.mark_unavailable(tt_id, unavailable)
+    return messages
+
+
+def remote_size(url):
+    """Get the size in bytes of a remote file (None if the server hides it)."""
+    length = HTTP.head(url).getheader('Content-Length')
+    return int(length) if length else None
+
+
+def fetch_range(url, part_name):
+    """Download a url to a partial file, resuming it from its current size.
+
+    Asks the server only for the missing bytes with a HTTP Range request, if
+    the server ignores it then the download starts again from the beginning.
+
+    """
+    offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+    with HTTP.open(url, headers) as response:
+        # Requested Range Not Satisfiable, nothing left to download
+        if response.status == 416:
+            response.read()
+            return
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        mode = 'ab' if offset and response.status == 206 else 'wb'
+        with open(part_name, mode) as part_file:
+            chunk = response.read(CHUNK_SIZE)
+            while chunk:
+                part_file.write(chunk)
+                chunk = response.read(CHUNK_SIZE)
+
+
+def get_video(vid_name, talk, cache):
+    """Gets the TED Talk video.
+
+    The variant downloaded is chosen by the quality policy (QUALITY). The
+    video is downloaded to a '.part' file and renamed only when complete, if
+    it's interrupted, the next run resumes it from where it was left. Returns
+    a message with the result.
+
+    """
+    if os.path.exists(vid_name):
+        return "Video {0} already downloaded.".format(vid_name)
+    choice = QUALITY.choose(talk, vid_name, cache)
+    if choice is None:
+        return ("Video {0} doesn't fit in the budget of the run, run again to "
+                "get it.".format(vid_name))
+    quality, vid_url, vid_size = choice
+    part_name = '{0}.part'.format(vid_name)
     if FOUND:
-        Popen(['wget', '-q', '-O', vid_name, vid_url],
-              stdout=PIPE).stdout.read()
+        subprocess.Popen(['wget', '-q', '-c', '-O', part_name, vid_url],
+                         stdout=subprocess.PIPE).communicate()
     else:
-        urllib.urlretrieve(vid_url, vid_name)
-    print("Video {0} downloaded.".format(vid_name))
-    return
+        fetch_range(vid_url, part_name)
+    part_size = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    if vid_size is not None and part_size > vid_size:
+        # Something went wrong with the resumed bytes, start again next time
+        os.remove(part_name)
+    if vid_size is not None and part_size != vid_size:
+        return ("Video {0} not complete ({1} of {2} bytes), run again to "
+                "resume it.".format(vid_name, part_size, vid_size))
+    os.rename(part_name, vid_name)
+    if os.path.exists('{0}.variant'.format(part_name)):
+        os.remove('{0}.variant'.format(part_name))
+    return "Video {0} downloaded{1}.".format(vid_name, '' if quality == 'high'
+                                             else ' ({0})'.format(quality))
+
+
+def talk_values(url, cache):
+    """Get the values of a talk from the cache or else from its web page.
+
+    Returns the result, 'found', 'unavailable' (the talk has no video to
+    download) or 'error', the talk (a dict with the keys 'id', 'intro', 'urls'
+    & 'page') or None, and a message if the talk wasn't found.
+
+    """
+    talk = cache.get(url)
+    if talk and REGEX_VID.findall(talk['urls'].get('high', '')):
+        return 'found', talk, ''
+    if talk:
+        # Kept by TEDTalks.py, that reads the pages without their videos too
+        return ('unavailable', None,
+                'Maybe this video is not available for download.')
+    # Reads the talk web page, only until the talk's values
+    try:
+        values = read_page(url)
+    except (IOError, httplib.HTTPException):
+        return 'error', None, "Are you sure this is the right URL?"
+    except ScrapeError:
+        return ('error', None, "{0}, are you sure this is the right "
+                "URL?".format(sys.exc_info()[1]))
+    if not REGEX_VID.findall(values['urls'].get('high', '')):
+        return ('unavailable', None,
+                'Maybe this video is not available for download.')
+    talk = {'id': values['id'], 'intro': values['intro'],
+            'urls': values['urls'], 'page': url}
+    cache.put(talk)
+    return 'found', talk, ''
+
+
+def missing_files(talk, langs, no_video):
+    """The files of a talk not downloaded yet: its video (unless no_video)
+    and its subtitles, but the ones that TED hasn't."""
+    video = REGEX_VID.findall(talk['urls']['high'])[0]
+    files = [] if no_video else [video]
+    files.extend("{0}.{1}.srt".format(video[:-4], lang) for lang in langs
+                 if lang not in talk.get('unavailable', ()))
+    return [name for name in files if not os.path.exists(name)]
+
+
+def read_urls(filename):
+    """Read the talks' urls from a file, one per line ('-' is the standard
+    input). The blank lines and the comments (#) are skipped."""
+    urls_file = sys.stdin if filename == '-' else open(filename)
+    try:
+        return [line.strip() for line in urls_file
+                if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if urls_file is not sys.stdin:
+            urls_file.close()
+
+
+def batch(urls, langs, no_video, jobs, video_jobs, cache):
+    """Get the subtitles (and videos) of many talks at the same time.
+
+    Every talk passes by a pipeline of three stages, its web page, its
+    subtitles and its video, and every stage has its own workers: at most
+    'jobs' pages and talks' subtitles, and 'video_jobs' videos at a time. So a
+    talk's subtitles are downloaded while the video of the previous one is.
+
+    Returns a report of every url, in the same order, a dict with its 'url',
+    its 'result' ('done', 'unavailable' or 'error') and its 'messages'.
+
+    """
+    reports = [{'url': url, 'result': 'done', 'messages': []} for url in urls]
+    pages, subs, videos = Queue.Queue(), Queue.Queue(), Queue.Queue()
+
+    def scrape(idx):
+        """Get the values of a talk and pass it to the subtitles' stage."""
+        result, talk, message = talk_values(urls[idx], cache)
+        if talk and not missing_files(talk, langs, no_video):
+            reports[idx]['messages'].append('Already downloaded.')
+        elif talk:
+            subs.put((idx, talk))
+        else:
+            reports[idx]['result'] = result
+            reports[idx]['messages'].append(message)
+
+    def subtitles(idx, talk):
+        """Get the subtitles of a talk and pass it to the videos' stage."""
+        video = REGEX_VID.findall(talk['urls']['high'])[0]
+        reports[idx]['messages'].extend(check_subs(talk['id'], talk['intro'],
+                                                   video, langs, cache))
+        if not no_video:
+            videos.put((idx, talk))
+
+    def video(idx, talk):
+        """Get the video of a talk."""
+        reports[idx]['messages'].append(get_video(
+            REGEX_VID.findall(talk['urls']['high'])[0], talk, cache))
+
+    def work(queue, stage):
+        """Run the jobs of a stage until get the stop signal (None)."""
+        for job in iter(queue.get, None):
+            try:
+                stage(*job)
+            except (IOError, OSError, httplib.HTTPException) as err:
+                reports[job[0]]['result'] = 'error'
+                reports[job[0]]['messages'].append(str(err))
+            except Exception as err:
+                # Any other failure (a bug, an unexpected page...) is only of
+                # this talk, the stage goes on with the next ones
+                reports[job[0]]['result'] = 'error'
+                reports[job[0]]['messages'].append('{0}: {1}'.format(
+                    type(err).__name__, err))
+
+    stages = [(pages, scrape, jobs), (subs, subtitles, jobs),
+              (videos, video, video_jobs)]
+    workers = []
+    for queue, stage, size in stages:
+        workers.append([threading.Thread(target=work, args=(queue, stage))
+                        for _ in range(max(size, 1))])
+        for worker in workers[-1]:
+            worker.daemon = True
+            worker.start()
+    for idx in range(len(urls)):
+        pages.put((idx,))
+    # Stop every stage once the previous one has passed it all its talks
+    for (queue, _, _), stage_workers in zip(stages, workers):
+        for _ in stage_workers:
+            queue.put(None)
+        for worker in stage_workers:
+            worker.join()
+    return reports
 
 
 def main():
     """main section"""
     # first, parse the options & arguments
     (opts, args) = options().parse_args()
-
-    # regex expressions to search into the webpage
-    regex_intro = re.compile('"introDuration":(\d+\.?\d+),')
-    regex_id = re.compile('"id":(\d+),')
-    regex_url = re.compile('"nativeDownloads":.*"high":"(.+)\?.+},"sub')
-    regex_vid = re.compile('http://.+\/(.*\.mp4)')
-
-    if not args:
+    langs = [lang.strip() for lang in opts.languages.split(',')
+             if lang.strip()]
+    urls = list(args)
+    if opts.batch:
+        urls.extend(read_urls(opts.batch))
+    urls = [url if '://' in url else 'http://' + url for url in urls]
+    QUALITY.quality = opts.quality
+    QUALITY.max_size = parse_size(opts.max_size)
+    QUALITY.budget = parse_size(opts.budget)
+
+    if not urls:
         options().print_help()
+    elif opts.batch or len(urls) > 1:
+        cache = TalkCache()
+        reports = batch(urls, langs, opts.no_video, opts.jobs,
+                        opts.video_jobs, cache)
+        cache.save()
+        for report in reports:
+            print("{0} [{1}]".format(report['url'], report['result']))
+            for message in report['messages']:
+                print("    {0}".format(message))
+        results = [report['result'] for report in reports]
+        print("{0} talks: {1} done, {2} not available for download, {3} with "
+              "errors".format(len(results), results.count('done'),
+                              results.count('unavailable'),
+                              results.count('error')))
+        if results.count('done') != len(results):
+            sys.exit(1)
     else:
-        tedtalk_webpage = args[0]
-        # Reads the talk web page, to search the talk's values
-        if FOUND:
-            ttalk_webpage = Popen(['wget', '-q', '-O', '-', tedtalk_webpage],
-                                  stdout=PIPE).stdout.read()
-        else:
-            try:
-                ttalk_webpage = urllib2.urlopen(tedtalk_webpage).read()
-            except ValueError:
-                ttalk_webpage = urllib2.urlopen('http://' +
-                                                tedtalk_webpage).read()
-        if ttalk_webpage:
-            try:
-                ttalk_intro = ((float(regex_intro.findall(ttalk_webpage)[0])
-                                + 1) * 1000)
-                ttalk_id = int(regex_id.findall(ttalk_webpage)[0])
-                ttalk_url = regex_url.findall(ttalk_webpage)[0]
-                ttalk_vid = regex_vid.findall(ttalk_url)[0]
-            except IndexError:
-                print('Maybe this video is not available for download.')
-                sys.exit(1)
-        else:
-            print("Are you sure this is the right URL?")
+        # The values of the talk may be read before, from its web page, and
+        # if all its files are there, nothing has to be read at all
+        cache = TalkCache()
+        talk = cache.get(urls[0])
+        if (talk and talk['urls'].get('high') and
+                not missing_files(talk, langs, opts.no_video)):
+            print("The talk is already downloaded.")
+            return
+        _, talk, message = talk_values(urls[0], cache)
+        if not talk:
+            print(message)
             sys.exit(1)
+        ttalk_url = talk['urls']['high']
+        ttalk_vid = REGEX_VID.findall(ttalk_url)[0]
         # Get subs (and video)
-        check_subs(ttalk_id, ttalk_intro, ttalk_vid)
+        for message in check_subs(talk['id'], talk['intro'], ttalk_vid, langs,
+                                  cache):
+            print(message)
+        cache.save()
         if not opts.no_video and ttalk_url:
-            get_video(ttalk_vid, ttalk_url)
+            print("Donwloading video...")
+            try:
+                print(get_video(ttalk_vid, talk, cache))
+            except (IOError, httplib.HTTPException):
+                print(str(sys.exc_info()[1]))
+                cache.save()
+                sys.exit(1)
 
 
 if __name__ == "__main__":
-    WIN_OS = True if platform.system() == 'Windows' else False
+    WIN_OS = True if os.name == 'nt' else False
     if not WIN_OS:
         FOUND = check_exec_posix('wget')
     main()
@@ -33,26 +33,26 @@ __date__ = "21/11/2012"
 __version__ = "2.0"
 
 try:
-    import feedparser
-    import getpass
+    import calendar
+    import contextlib
     import glob
+    import itertools
     import json
     import os
     import pickle
-    import platform
+    import Queue
+    import random
     import re
-    import socket
-    import smtplib
+    import signal
     import sys
+    import tempfile
+    import threading
     import time
-    import urllib
-    import urllib2
     from argparse import ArgumentParser
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    from email.utils import COMMASPACE, formatdate
-    from subprocess import Popen, PIPE
     from textwrap import fill
+    from tedcommon import (CHUNK_SIZE, HTTP, METER, LazyModule,
+                           ResponseStream, ScrapeError, TalkCache, get_sub,
+                           parse_size, read_page)
 except ImportError:
     # Checks the installation of the necessary python modules
     print((os.linesep * 2).join(["An error found importing one module:",
@@ -60,17 +60,87 @@ except ImportError:
     sys.exit(-2)
 
 
+email_utils = LazyModule('email.utils')
+hashlib = LazyModule('hashlib')
+httplib = LazyModule('httplib')
+multiprocessing = LazyModule('multiprocessing')
+smtplib = LazyModule('smtplib')
+socket = LazyModule('socket')
+sqlite3 = LazyModule('sqlite3')
+urllib = LazyModule('urllib')
+urllib2 = LazyModule('urllib2')
+urlparse = LazyModule('urlparse')
+ElementTree = LazyModule('xml.etree.cElementTree')
+
+# the TED Talks HD RSS feed
+FEED_URL = 'http://feeds.feedburner.com/tedtalksHD'
+# the talks' web pages by id, enumerated by the catalog sync: the ids read
+# between checkpoints, the ids missing in a row that end the catalog and the
+# times that a talk is tried before giving it up
+CATALOG_URL = 'http://www.ted.com/talks/view/id/{0}'
+CATALOG_WINDOW = 20
+CATALOG_GAP = 50
+CATALOG_RETRIES = 3
+# seconds that the lease of a talk lasts, if the host that downloads it from
+# a shared folder doesn't renew it (see Leases)
+LEASE_TTL = 300
+# bytes of the blocks hashed one by one to get the checksum of a video
+HASH_BLOCK = 8 * 2 ** 20
+# bytes of the log file and seconds of its period to rotate it, and number
+# of rotated log files kept
+LOG_MAX_SIZE = 2 ** 20
+LOG_MAX_AGE = 30 * 86400
+LOG_BACKUPS = 5
+# bytes of the log sent by mail, the rest is only in the log file, seconds
+# that an operation with the mail server waits at most, seconds to wait
+# before trying to send again the mails that failed (and after which a mail
+# left in flight by a run that ended while sending it is dropped) and seconds
+# that a run waits for its mails at its end (see Outbox)
+MAIL_MAX_SIZE = 2 ** 20
+MAIL_TIMEOUT = 10
+MAIL_RETRY = 300
+MAIL_WAIT = 2
+# version of the format of the state file (.data.pkl)
+STATE_VERSION = 1
+# priorities of the jobs & transfers, the lower the sooner: the subtitles and
+# the pages first, then the new videos and the older ones (backfill) last
+PRIORITY_URGENT = 0
+PRIORITY_VIDEO = 1
+PRIORITY_BACKFILL = 2
+# qualities of the videos, the best first: the one of the HD feed and the
+# ones of the talks' web pages
+QUALITIES = ('hd', 'high', 'medium', 'low')
+
+# namespaces of the RSS feed's elements
+NS_CONTENT = '{http://purl.org/rss/1.0/modules/content/}'
+NS_FEEDBURNER = '{http://rssnamespace.org/feedburner/ext/1.0}'
+NS_ITUNES = '{http://www.itunes.com/dtds/podcast-1.0.dtd}'
+NS_MEDIA = '{http://search.yahoo.com/mrss/}'
+
+
 class Logger():
     """
 
     Create a log object to log script messages.
 
-    These messages can be sended via email or writed in a log file
+    These messages can be sended via email or writed in a log file. Every
+    message is written to the log file as soon as it's logged, the log file
+    is never overwritten but rotated when it's too big or old, and the
+    messages of this run are kept in a temporary file (not in memory) until
+    they are sent.
 
     """
 
-    def __init__(self):
-        """Create the object Logger itself and set two variables.
+    def __init__(self, log_format='text', max_size=LOG_MAX_SIZE,
+                 max_age=LOG_MAX_AGE, backups=LOG_BACKUPS):
+        """Create the object Logger itself and set some variables.
+
+        (str) log_format -- 'text' (blocks & lists) or 'json' (a JSON object
+                            by line) for the log file
+        (int) max_size -- the bytes of the log file to rotate it
+        (int) max_age -- the seconds of the period of the log file, it's
+                         rotated in the first run of every period
+        (int) backups -- the number of rotated log files kept
 
         This variable is about this python file:
 
@@ -78,12 +148,20 @@ class Logger():
         filename = the log file's name
 
         """
-        self.__log = ''
         self.__script_name = os.path.basename(__file__).split('.')[0]
-        self.filename = '{0}.log'.format(self.__script_name)
+        self.filename = '{0}.{1}'.format(self.__script_name,
+                                         {'text': 'log',
+                                          'json': 'jsonl'}[log_format])
+        self.__json = log_format == 'json'
+        self.__max_size = max_size
+        self.__max_age = max_age
+        self.__backups = backups
+        self.__file = None
+        self.__run = tempfile.TemporaryFile()
+        self.__size = 0
 
     def __len__(self):
-        return len(self.__log)
+        return self.__size
 
     def __format__(self, tit, cont, decor):
         """Format a block or a list of lines to enhance comprehension.
@@ -98,9 +176,52 @@ class Logger():
         ending = {'=': '', '_': os.linesep}[decor]
         end = {'=': '=' * 80, '_': ''}[decor]
         begin = ' '.join([tit.upper(), (80 - (len(tit) + 1)) * decor]) + ending
-        cont = [cont] if isinstance(cont, str) else cont
+        cont = [cont] if isinstance(cont, str) else list(cont)
         sep = os.linesep
-        self.__log += sep.join([begin, sep.join(cont), end, sep])
+        self.__emit(sep.join([begin, sep.join(cont), end, sep]),
+                    {'=': 'block', '_': 'list'}[decor], tit, cont)
+
+    def __emit(self, text, kind, title, lines):
+        """Write a message to this run's log and to the log file."""
+        self.__run.write(text)
+        self.__size += len(text)
+        if self.__file is None:
+            self.__open()
+        elif (self.__file.tell() >= self.__max_size or
+              time.time() // self.__max_age > self.__period):
+            self.__file.close()
+            self.__rotate()
+            self.__file = open(self.filename, 'ab')
+            self.__period = time.time() // self.__max_age
+        if self.__json:
+            record = {'time': time.time(), 'script': self.__script_name,
+                      'kind': kind, 'title': title, 'lines': lines}
+            text = json.dumps(record) + '\n'
+        self.__file.write(text)
+        self.__file.flush()
+
+    def __open(self):
+        """Open the log file to append the messages, rotating it before if
+        it's too big or from a previous period."""
+        if os.path.exists(self.filename):
+            period = time.time() // self.__max_age
+            if (os.path.getsize(self.filename) >= self.__max_size or
+                    os.path.getmtime(self.filename) // self.__max_age <
+                    period):
+                self.__rotate()
+        self.__file = open(self.filename, 'ab')
+        self.__period = time.time() // self.__max_age
+
+    def __rotate(self):
+        """Rename the log file to log.1, the log.1 to log.2... dropping the
+        oldest one."""
+        names = [self.filename] + ['{0}.{1}'.format(self.filename, idx) for
+                                   idx in range(1, self.__backups + 1)]
+        if os.path.exists(names[-1]):
+            os.remove(names[-1])
+        for older, newer in reversed(zip(names[1:], names[:-1])):
+            if os.path.exists(newer):
+                os.rename(newer, older)
 
     def block(self, title, content):
         """A block of text lines headed and followed by a line full of '='.
@@ -141,7 +262,7 @@ class Logger():
 
         """
         if isinstance(content, str):
-            self.__log += content + os.linesep * 2
+            self.__emit(content + os.linesep * 2, 'free', '', [content])
 
     def time(self, title):
         """A self.block() formated line with current time and date.
@@ -176,87 +297,1516 @@ class Logger():
         script = '{0} (ver. {1})'.format(self.__script_name, __version__)
         self.block('Script', [script, url, '', msg])
 
-    def get(self):
-        """Get the log content."""
-        return self.__log
+    def get(self, limit=None):
+        """Get the log content of this run (only its first bytes if limit)."""
+        self.__run.seek(0)
+        content = self.__run.read(-1 if limit is None else limit)
+        self.__run.seek(0, os.SEEK_END)
+        return content
+
+    def send(self, subject, outbox):
+        """Queue the log of this run to send it by mail.
+
+        (str) subject -- the mail's subject
+        (Outbox) outbox -- the mails waiting to be sent
+
+        Only the first MAIL_MAX_SIZE bytes of the log are sent, the rest is
+        only in the log file.
+
+        """
+        content = self.get(MAIL_MAX_SIZE)
+        if self.__size > MAIL_MAX_SIZE:
+            content += '{0}[...] See the rest in {1}{0}'.format(
+                os.linesep * 2, os.path.abspath(self.filename))
+        outbox.put(subject, content)
+
+    def clear(self):
+        """Drop the messages of this run, e.g. once sent."""
+        self.__run.seek(0)
+        self.__run.truncate()
+        self.__size = 0
+
+    def close(self):
+        """Close the log file and drop the messages of this run."""
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__run.close()
+
+
+class Outbox():
+    """
+
+    The mails with the logs of the runs, kept on disk until they are sent.
+
+    Every log is queued as a file in a folder ('.outbox') and a thread sends
+    them in the background, so a slow or dead mail server never stalls the
+    downloads. A mail that can't be sent stays in the folder and it's tried
+    again later, by the thread or by the next run. With a digest period, the
+    logs queued are sent together, in a mail at most once every period,
+    instead of a mail by run. Every operation with the mail server has a
+    timeout, and its session is kept open to send the next mails.
 
-    def send(self, subject, send_from='', dest_to='', mail_server='localhost',
-             server_user='', server_pass=''):
-        """Send a email with the log.
+    A mail is renamed to an in-flight name ('.sending') while it's sent, so
+    another run never sends it too. If the run ends in the middle, the mail
+    may have been sent or not: it's dropped later, with an error, instead of
+    sending it again. No mail starts to be sent after close().
+
+    """
 
-        Arguments:
-            (str) send_from -- a sender's email address (default '')
-            (str or list) dest_to -- a list of receivers' email addresses ('')
-            (str) subject -- the mail's subject
-            (str) mail_server -- the smtp server (default 'localhost')
-            (str) server_user -- the smtp server user (default '')
-            (str) server_pass --the smtp server password (default '')
+    def __init__(self, folder='.outbox', digest=0, mail_server='localhost',
+                 send_from='', dest_to='', server_user='', server_pass='',
+                 timeout=MAIL_TIMEOUT):
+        """Create the outbox, the mails queued by previous runs are sent too.
+
+        (str) folder -- the folder of the mails queued
+        (int) digest -- the seconds between mails at least, 0 for a mail by
+                        log queued
+        (str) mail_server -- the smtp server, with its port if it's not the
+                             default one, e.g. 'localhost:2525'
+        (str) send_from -- a sender's email address
+        (str or list) dest_to -- a list of receivers' email addresses
+        (str) server_user -- the smtp server user, to login if it's not ''
+        (str) server_pass -- the smtp server password
+        (float) timeout -- the seconds that an operation with the server
+                           waits at most
 
         If 'send_from' or 'dest_to' are empty or None, then script user's
-        mailbox is assumed instead. Useful for loggin scripts
+        mailbox is assumed instead.
+
+        """
+        self.folder = folder
+        self.digest = digest
+        self.mail_server = mail_server
+        self.send_from = send_from
+        self.dest_to = dest_to
+        self.server_user = server_user
+        self.server_pass = server_pass
+        self.timeout = timeout
+        self.errors = []
+        self.__session = None
+        self.__wake = threading.Event()
+        self.__closing = threading.Event()
+        self.__closed = threading.Event()
+        self.__thread = None
+
+    def put(self, subject, content):
+        """Queue a log to send it by mail and wake the sender up.
+
+        (str) subject -- the mail's subject
+        (str) content -- the log
+
+        """
+        if not os.path.isdir(self.folder):
+            try:
+                os.mkdir(self.folder)
+            except OSError:
+                if not os.path.isdir(self.folder):
+                    raise
+        # The mails are named by their time, so they are sent in order
+        now = time.time()
+        fd, tmp_name = tempfile.mkstemp('.tmp', '{0:017.6f}.'.format(now),
+                                        self.folder)
+        with os.fdopen(fd, 'wb') as mail_file:
+            pickle.dump({'subject': subject, 'time': now,
+                         'content': content}, mail_file)
+        os.rename(tmp_name, '{0}.mail'.format(tmp_name[:-4]))
+        self.__wake.set()
+
+    def queued(self):
+        """The files of the mails queued, the oldest first."""
+        return sorted(glob.glob(os.path.join(self.folder, '*.mail')))
+
+    def due(self):
+        """The seconds until the next mail can be sent (0, now)."""
+        sent_name = os.path.join(self.folder, 'sent')
+        if not self.digest or not os.path.exists(sent_name):
+            return 0
+        return max(0, os.path.getmtime(sent_name) + self.digest - time.time())
+
+    def start(self):
+        """Start sending the mails queued in the background."""
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__sender)
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def __sender(self):
+        """Send the mails as they are queued, until the outbox is closed and
+        there is nothing more to send now."""
+        while not self.__closed.is_set():
+            wait = self.flush()
+            if self.__closing.is_set() and (wait is not None or
+                                            not self.queued()):
+                break
+            self.__wake.wait(wait)
+            self.__wake.clear()
+        self.__disconnect()
+
+    def flush(self):
+        """Send the mails queued, if it's their time.
+
+        Returns None if all of them were sent, or the seconds to wait before
+        trying it again: until the next digest or, if the server failed,
+        MAIL_RETRY. The errors are added to the errors list.
 
         """
+        self.__drop_interrupted()
+        names = self.queued()
+        if not names:
+            return None
+        wait = self.due()
+        if wait:
+            return wait
+        mails = []
+        for name in names:
+            sending = '{0}.sending'.format(name[:-5])
+            try:
+                os.rename(name, sending)
+                os.utime(sending, None)
+            except OSError:
+                # Taken by another run
+                continue
+            try:
+                with open(sending, 'rb') as mail_file:
+                    mails.append((sending, pickle.load(mail_file)))
+            except (EOFError, IOError, pickle.PickleError):
+                self.errors.append('{0}: unreadable mail, dropped'.
+                                   format(os.path.basename(name)))
+                os.remove(sending)
+        groups = [mails] if self.digest else [[mail] for mail in mails]
+        try:
+            for group in groups:
+                if self.__closed.is_set():
+                    break
+                if group:
+                    self.__send(group)
+        except (socket.error, smtplib.SMTPException):
+            self.errors.append('mail error: {0}'.format(sys.exc_info()[1]))
+            self.__disconnect()
+            return MAIL_RETRY
+        finally:
+            # The mails not sent are queued again
+            for sending, _ in mails:
+                if os.path.exists(sending):
+                    os.rename(sending, '{0}.mail'.format(sending[:-8]))
+        return None
+
+    def __drop_interrupted(self):
+        """Drop the mails left in flight by the runs that ended while they
+        were sending them (they may have been sent), with an error."""
+        for name in glob.glob(os.path.join(self.folder, '*.sending')):
+            try:
+                if time.time() - os.path.getmtime(name) > MAIL_RETRY:
+                    os.remove(name)
+                    self.errors.append('{0}: interrupted while it was sent, '
+                                       'maybe not sent, dropped'.
+                                       format(os.path.basename(name)))
+            except OSError:
+                pass
+
+    def __send(self, mails):
+        """Send a mail with some logs queued, then drop their files.
+
+        (list) mails -- the logs, (file's name, dict) pairs
+
+        """
+        # Only the runs that send the log need these
+        import getpass
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        from email.utils import COMMASPACE, formatdate
+
         local_email = '@'.join([getpass.getuser(), socket.gethostname()])
-        if not send_from:
-            send_from = local_email
-        if not dest_to:
-            dest_to = [local_email]
+        send_from = self.send_from or local_email
+        dest_to = self.dest_to or [local_email]
+        dest_to = [dest_to] if isinstance(dest_to, str) else dest_to
+
+        last = mails[-1][1]
+        subject = last['subject']
+        if len(mails) > 1:
+            subject = '{0} ({1} runs)'.format(subject, len(mails))
+        content = (os.linesep * 2).join(mail['content'] for _, mail in mails)
+        if len(content) > MAIL_MAX_SIZE:
+            content = content[:MAIL_MAX_SIZE]
+            content += '{0}[...] See the rest in the log file{0}'.format(
+                os.linesep * 2)
 
-        dest_to_addrs = COMMASPACE.join(dest_to)  # receivers mails
         message = MIMEMultipart()
-        message['Subject'] = '{0} - {1}'.format(subject,
-                                                time.strftime('%A %x, %X'))
+        message['Subject'] = '{0} - {1}'.format(
+            subject, time.strftime('%A %x, %X', time.localtime(last['time'])))
         message['From'] = send_from
-        message['To'] = dest_to_addrs
+        message['To'] = COMMASPACE.join(dest_to)
         message['Date'] = formatdate(localtime=True)
         message.preamble = "You'll not see this in a MIME-aware mail reader.\n"
-        message.attach(MIMEText(self.__log))
+        message.attach(MIMEText(content))
+
+        self.__connect().sendmail(send_from, dest_to, message.as_string())
+        for name, _ in mails:
+            os.remove(name)
+        with open(os.path.join(self.folder, 'sent'), 'w'):
+            pass
+
+    def __connect(self):
+        """The session with the mail server, the open one if it's alive."""
+        if self.__session is not None:
+            try:
+                if self.__session.noop()[0] == 250:
+                    return self.__session
+            except (socket.error, smtplib.SMTPException):
+                pass
+            self.__disconnect()
+        session = smtplib.SMTP(self.mail_server, timeout=self.timeout)
+        if self.server_user:
+            try:
+                session.login(self.server_user, self.server_pass)
+            except (socket.error, smtplib.SMTPException):
+                session.close()
+                raise
+        self.__session = session
+        return session
+
+    def __disconnect(self):
+        """Close the session with the mail server, if any."""
+        if self.__session is not None:
+            try:
+                self.__session.quit()
+            except (socket.error, smtplib.SMTPException):
+                self.__session.close()
+            self.__session = None
+
+    def close(self, wait=MAIL_WAIT):
+        """Wait a while for the mails queued to be sent, then stop sending
+        them (the ones left are sent by the next run).
+
+        (float) wait -- the seconds to wait at most
+
+        """
+        self.__closing.set()
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join(wait)
+            self.__thread = None
+        self.__closed.set()
+
+
+class Scheduler():
+    """
+
+    Run the download jobs in bounded pools of worker threads.
+
+    Every pool (e.g. 'video' and 'subs') has its own number of workers, so the
+    videos and the subtitles are downloaded at the same time, but never more
+    jobs of each kind than the workers of its pool. The jobs of a pool run by
+    their priority, and in the order they were queued for the same priority.
+
+    """
+
+    def __init__(self, workers):
+        """Create the pools and start their workers.
+
+        (dict) workers -- the number of workers for each pool, {name: int}
+
+        """
+        self.__sizes = dict((pool, max(1, size)) for pool, size in
+                            workers.items())
+        self.__queues = dict((pool, Queue.PriorityQueue()) for pool in
+                             self.__sizes)
+        self.__order = itertools.count()
+        self.__results = {}
+        self.__lock = threading.Lock()
+        self.__threads = []
+        for pool, size in self.__sizes.items():
+            for _ in range(size):
+                worker = threading.Thread(target=self.__work, args=(pool,))
+                worker.daemon = True
+                worker.start()
+                self.__threads.append(worker)
+
+    def __work(self, pool):
+        """Run the jobs of a pool until get the stop signal (None)."""
+        queue = self.__queues[pool]
+        while True:
+            _, _, job = queue.get()
+            if job is None:
+                return
+            key, func, args = job
+            try:
+                result = (True, func(*args))
+            except Exception:
+                result = (False, str(sys.exc_info()[1]))
+            with self.__lock:
+                self.__results[(pool, key)] = result
+
+    def submit(self, pool, key, priority, func, *args):
+        """Queue a job in a pool.
+
+        (str) pool -- the pool that runs the job
+        (hashable) key -- the key to find the job's result
+        (tuple) priority -- the lower, the sooner it runs, e.g. (PRIORITY_X,)
+        (callable) func -- the job itself, called as func(*args)
+
+        """
+        self.__queues[pool].put((priority, next(self.__order),
+                                 (key, func, args)))
+
+    def join(self):
+        """Wait for all the jobs, stop the workers and return the results.
+
+        Returns a dictionary {(pool, key): (success, value)} where value is the
+        job's returned value or the error message if the job failed.
+
+        """
+        for pool, size in self.__sizes.items():
+            for _ in range(size):
+                self.__queues[pool].put(((sys.maxint,), next(self.__order),
+                                         None))
+        for worker in self.__threads:
+            worker.join()
+        return self.__results
+
+
+class Library():
+    """
+
+    Index of the talks' videos and subtitles stored in the videos' folder.
+
+    The index is a SQLite database (.library.db) with the talks, their files,
+    the subtitles' languages, the videos' variants (see QualityPolicy), the
+    sizes and the download dates. It's updated, in a transaction, as every
+    download finishes. The names of the files are also kept in memory to know
+    if a file is stored without asking the disk.
+
+    If the database doesn't exist, it's rebuilt from the files in the folder.
+
+    The size of the library is kept up to date as the files are added and
+    removed, and it can be limited by a quota: before a video is downloaded,
+    the library makes room for it evicting (removing) other talks, first the
+    ones chosen by the eviction policy:
+
+    'oldest' -- the oldest published talks
+    'unused' -- the least recently accessed (watched) videos
+    'nolang' -- the talks without subtitles, then the oldest
+
+    In a folder shared by several hosts, the index is shared too, but it's
+    only a hint: SQLite's locks are unreliable on network mounts, so a write
+    of a host may be lost. Whether a file is stored is always asked to the
+    folder itself (see refresh()), never to the shared index, and the sizes
+    of the files are read again from it before making room for a video, as
+    the other hosts add and evict files. A damaged index is rebuilt with -r.
+
+    """
+
+    def __init__(self, filename='.library.db', quota=0, policy='oldest',
+                 shared=False):
+        """Open the index, building it if it doesn't exist.
+
+        (str) filename -- the name of the index's database
+        (int) quota -- the bytes that the library can take, 0 is no limit
+        (str) policy -- the talks evicted first, 'oldest', 'unused' or
+                        'nolang'
+        (bool) shared -- the folder is shared by several hosts
+
+        """
+        rebuild = not os.path.exists(filename)
+        self.filename = filename
+        self.quota = quota
+        self.policy = policy
+        self.shared = shared
+        self.__reserved = {}
+        self.evicted, self.skipped = [], []
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(filename, check_same_thread=False)
+        with self.__db:
+            self.__db.execute('CREATE TABLE IF NOT EXISTS talks ('
+                              'id INTEGER PRIMARY KEY, title TEXT, '
+                              'published REAL, video TEXT)')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS files ('
+                              'name TEXT PRIMARY KEY, talk INTEGER, '
+                              'lang TEXT, size INTEGER, downloaded REAL, '
+                              'checksum TEXT, variant TEXT)')
+            # The files rejected by verify(), to download them again
+            self.__db.execute('CREATE TABLE IF NOT EXISTS rejected ('
+                              'name TEXT PRIMARY KEY, talk INTEGER)')
+            # The first versions of the index had no checksums nor variants
+            columns = [column[1] for column in self.__db.execute(
+                'PRAGMA table_info(files)')]
+            for column in ('checksum', 'variant'):
+                if column not in columns:
+                    self.__db.execute('ALTER TABLE files ADD COLUMN {0} '
+                                      'TEXT'.format(column))
+        if rebuild:
+            self.rebuild()
+        self.__files = dict(self.__db.execute('SELECT name, size FROM files'))
+        self.__size = sum(self.__files.values())
+
+    def __contains__(self, name):
+        return name in self.__files
+
+    def __len__(self):
+        return len(self.__files)
+
+    def size(self):
+        """The bytes of all the files of the library."""
+        return self.__size
+
+    def add(self, name, talk=None, lang=None, checksum=None, variant=None):
+        """Index a file of the folder.
+
+        (str) name -- the name of the file (a video or a subtitle)
+        (int) talk -- the talk's id (None if unknown)
+        (str) lang -- the subtitle's language (None for the videos)
+        (str) checksum -- the file's checksum, see Checksum (None if unknown)
+        (str) variant -- the video's quality, see QUALITIES (None if unknown)
+
+        """
+        size = os.path.getsize(name)
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('INSERT OR REPLACE INTO files VALUES '
+                                  '(?, ?, ?, ?, ?, ?, ?)',
+                                  (name, talk, lang, size, time.time(),
+                                   checksum, variant))
+                self.__db.execute('DELETE FROM rejected WHERE name = ?',
+                                  (name,))
+            self.__size += size - self.__files.get(name, 0)
+            self.__files[name] = size
+            self.__reserved.pop(name, None)
+
+    def add_talk(self, talk, title, published, video):
+        """Index a talk.
+
+        (int) talk -- the talk's id
+        (unicode) title -- the talk's title
+        (time.struct_time) published -- the talk's date of publication (UTC),
+                                        None if unknown
+        (str) video -- the name of the talk's video
+
+        """
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('INSERT OR REPLACE INTO talks VALUES '
+                                  '(?, ?, ?, ?)',
+                                  (talk, title, calendar.timegm(published)
+                                   if published else None, video))
+
+    def video(self, talk):
+        """The name of a talk's video in the library, or left to download
+        again (interrupted or rejected, see unfinished()), or None."""
+        with self.__lock:
+            row = self.__db.execute('SELECT video FROM talks WHERE id = ?',
+                                    (talk,)).fetchone()
+        if row and (row[0] in self.__files or self.rejected(row[0]) or
+                    os.path.exists('{0}.part'.format(row[0]))):
+            return row[0]
+        return None
+
+    def rejected(self, name):
+        """True if a file was rejected by verify(), and it's not downloaded
+        again yet."""
+        with self.__lock:
+            return self.__db.execute('SELECT 1 FROM rejected WHERE name = ?',
+                                     (name,)).fetchone() is not None
+
+    def unfinished(self, langs):
+        """The talks of the library with work left, a list of (talk, title,
+        published, video).
+
+        Their videos were interrupted or rejected by verify(), or they are
+        stored but some of the subtitles of the languages wanted are missing.
+
+        """
+        parts = set(name[:-5] for name in glob.glob('*.mp4.part'))
+        with self.__lock:
+            rejected = set(name for (name,) in self.__db.execute(
+                'SELECT name FROM rejected'))
+            return [(talk, title, published, video) for
+                    talk, title, published, video in self.__db.execute(
+                        'SELECT id, title, published, video FROM talks')
+                    if (video not in self.__files and
+                        (video in rejected or video in parts)) or
+                    (video in self.__files and
+                     [lang for lang in langs if '{0}.{1}.srt'.format(
+                         video[:-4], lang) not in self.__files])]
+
+    def refresh(self, names):
+        """Read again some files from the folder, the ones added or removed
+        by other hosts that share it.
+
+        The files themselves are looked for, not their rows in the shared
+        index, so a video is never downloaded again because another host's
+        write to the index was lost.
+
+        """
+        with self.__lock:
+            for name in names:
+                self.__size -= self.__files.pop(name, 0)
+                if os.path.exists(name):
+                    self.__files[name] = os.path.getsize(name)
+                    self.__size += self.__files[name]
+
+    def variant(self, name):
+        """The quality of a video of the library (None if unknown)."""
+        with self.__lock:
+            row = self.__db.execute('SELECT variant FROM files WHERE name = ?',
+                                    (name,)).fetchone()
+        return row[0] if row else None
+
+    def files(self):
+        """All the files indexed, a list of (name, size, checksum)."""
+        with self.__lock:
+            return self.__db.execute('SELECT name, size, checksum FROM '
+                                     'files').fetchall()
+
+    def set_checksum(self, name, checksum):
+        """Store the checksum of a file already indexed."""
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('UPDATE files SET checksum = ? WHERE '
+                                  'name = ?', (checksum, name))
+
+    def publish_hours(self):
+        """The number of talks published by hour of the week, a dict by
+        (weekday, hour), in UTC."""
+        hours = {}
+        with self.__lock:
+            for (published,) in self.__db.execute('SELECT published FROM '
+                                                  'talks WHERE published IS '
+                                                  'NOT NULL'):
+                moment = time.gmtime(published)
+                hours[(moment.tm_wday, moment.tm_hour)] = hours.get(
+                    (moment.tm_wday, moment.tm_hour), 0) + 1
+        return hours
+
+    def reject(self, name):
+        """Drop a wrong file from the index, recording it to download it
+        again (see unfinished())."""
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('INSERT OR REPLACE INTO rejected SELECT '
+                                  'name, talk FROM files WHERE name = ?',
+                                  (name,))
+                self.__db.execute('DELETE FROM files WHERE name = ?', (name,))
+            self.__size -= self.__files.pop(name, 0)
+
+    def rebuild(self):
+        """Index again all the videos and subtitles found in the folder."""
+        files = []
+        for name in glob.glob('*.mp4') + glob.glob('*.srt'):
+            lang = name.split('.')[-2] if name.endswith('.srt') else None
+            files.append((name, None, lang, os.path.getsize(name),
+                          os.path.getmtime(name), None, None))
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('DELETE FROM files')
+                self.__db.executemany('INSERT INTO files VALUES '
+                                      '(?, ?, ?, ?, ?, ?, ?)', files)
+            self.__files = dict((name, size) for name, _, _, size, _, _, _ in
+                                files)
+            self.__size = sum(self.__files.values())
+
+    def reserve(self, name, size):
+        """Make room in the quota for a video before downloading it.
+
+        (str) name -- the name of the video
+        (int) size -- the bytes of the video
+
+        Evicts the talks chosen by the policy (never the ones with room
+        reserved) until the video fits. Returns the names of the files
+        evicted, or None if the video doesn't fit even evicting all of them.
+        Both are also recorded, in the evicted & skipped lists.
+
+        """
+        with self.__lock:
+            self.__reserved[name] = size
+            if not self.quota:
+                return []
+            if self.shared:
+                # The other hosts add and evict files too
+                self.__files = dict(self.__db.execute(
+                    'SELECT name, size FROM files'))
+                self.__size = sum(self.__files.values())
+            excess = (self.__size + sum(self.__reserved.values()) -
+                      self.quota)
+            if excess <= 0:
+                return []
+            victims, freed = [], 0
+            for video in self.__candidates():
+                if freed >= excess:
+                    break
+                talk_files = [video] + [sub for sub in self.__files if
+                                        sub.startswith(video[:-4] + '.') and
+                                        sub.endswith('.srt')]
+                victims.extend(talk_files)
+                freed += sum(self.__files.get(talk_file, 0) for talk_file
+                             in talk_files)
+            if freed < excess:
+                del self.__reserved[name]
+                self.skipped.append(name)
+                return None
+            for victim in victims:
+                if os.path.exists(victim):
+                    os.remove(victim)
+                self.__size -= self.__files.pop(victim, 0)
+            with self.__db:
+                self.__db.executemany('DELETE FROM files WHERE name = ?',
+                                      ((victim,) for victim in victims))
+            self.evicted.extend(victims)
+            return victims
+
+    def unreserve(self, names):
+        """Free the room reserved for videos that won't be downloaded."""
+        with self.__lock:
+            for name in names:
+                self.__reserved.pop(name, None)
+
+    def __candidates(self):
+        """The videos of the library, in the order they can be evicted."""
+        with_subs = set(name.rsplit('.', 2)[0] for name in self.__files
+                        if name.endswith('.srt'))
+        videos = [(name, published, name[:-4] in with_subs) for
+                  name, published in self.__db.execute(
+                      'SELECT files.name, COALESCE(talks.published, '
+                      'files.downloaded) FROM files LEFT JOIN talks ON '
+                      'talks.video = files.name WHERE files.lang IS NULL')
+                  if name not in self.__reserved]
+        if self.policy == 'unused':
+            videos = [(os.stat(name).st_atime if os.path.exists(name) else 0,
+                       name) for name, _, _ in videos]
+        elif self.policy == 'nolang':
+            videos = [((subs, published), name) for name, published, subs in
+                      videos]
+        else:
+            videos = [(published, name) for name, published, _ in videos]
+        return [name for _, name in sorted(videos)]
+
+    def close(self):
+        """Close the index's database."""
+        with self.__lock:
+            self.__db.close()
+
+
+class Catalog():
+    """
+
+    Work queue of the sync of all the TED talks, not only the feed's.
+
+    The talks' ids are enumerated in order, a window of ids at a time, and
+    every talk found is queued to download it. The queue and the checkpoint
+    of the enumeration (the next id and the ids missing in a row) are kept
+    in a SQLite database (.catalog.db), updated in a transaction after every
+    window, so a sync of thousands of talks that lasts days goes on from
+    where it was left after a restart, and never starts from scratch.
+
+    The states of the talks are:
+
+    'pending' -- its web page couldn't be read yet (a network error)
+    'missing' -- there's no talk with the id
+    'unavailable' -- the talk has no video to download
+    'queued' -- the talk has to be downloaded
+    'done' -- the talk is downloaded
+    'skipped' -- the talk doesn't fit in the quota
+    'failed' -- the talk was tried too many times
+
+    """
+
+    def __init__(self, filename='.catalog.db'):
+        """Open the queue, creating it if it doesn't exist.
+
+        (str) filename -- the name of the queue's database
+
+        """
+        self.filename = filename
+        self.__db = sqlite3.connect(filename)
+        with self.__db:
+            self.__db.execute('CREATE TABLE IF NOT EXISTS talks ('
+                              'id INTEGER PRIMARY KEY, state TEXT, '
+                              'title TEXT, page TEXT, published REAL, '
+                              'video TEXT, size INTEGER, attempts INTEGER, '
+                              'updated REAL)')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS checkpoint ('
+                              'name TEXT PRIMARY KEY, value INTEGER)')
+            self.__db.executemany('INSERT OR IGNORE INTO checkpoint VALUES '
+                                  '(?, ?)', (('next', 1), ('misses', 0)))
+
+    def __checkpoint(self):
+        """The next id to enumerate and the ids missing in a row before it."""
+        values = dict(self.__db.execute('SELECT name, value FROM checkpoint'))
+        return values['next'], values['misses']
+
+    def restart(self, gap=CATALOG_GAP):
+        """Look again for the new talks past the end of the catalog.
+
+        If the last sync reached the end (gap ids missing in a row), the
+        enumeration goes back to the first of them.
+
+        """
+        next_id, misses = self.__checkpoint()
+        if misses >= gap:
+            with self.__db:
+                self.__db.executemany('UPDATE checkpoint SET value = ? WHERE '
+                                      'name = ?', ((next_id - misses, 'next'),
+                                                   (0, 'misses')))
+
+    def window(self, size=CATALOG_WINDOW, gap=CATALOG_GAP):
+        """The ids to read next, the pending ones first and then the next ids
+        of the enumeration (none once the end of the catalog is reached)."""
+        ids = [talk for (talk,) in self.__db.execute(
+            'SELECT id FROM talks WHERE state = ? ORDER BY id LIMIT ?',
+            ('pending', size))]
+        next_id, misses = self.__checkpoint()
+        if misses < gap:
+            ids.extend(range(next_id, next_id + size - len(ids)))
+        return ids
+
+    def record(self, ids, results, retries=CATALOG_RETRIES):
+        """Store the talks read from a window and move the checkpoint on.
+
+        (list) ids -- the ids of the window, see window()
+        (dict) results -- the result of reading every id, see scrape_talk(),
+                          a (success, (state, values)) or (False, error)
+
+        Returns the errors, a list of (id, error).
+
+        """
+        next_id, misses = self.__checkpoint()
+        rows, errors = [], []
+        for talk in sorted(ids):
+            success, result = results.get(talk, (False, 'Not read'))
+            state, values = result if success else ('pending', {})
+            if not success:
+                errors.append((talk, result))
+                attempts = self.__db.execute(
+                    'SELECT attempts FROM talks WHERE id = ?',
+                    (talk,)).fetchone()
+                attempts = (attempts[0] if attempts else 0) + 1
+                if attempts >= retries:
+                    state = 'failed'
+            else:
+                attempts = 0
+            rows.append((talk, state, values.get('title'),
+                         values.get('page'), values.get('published'),
+                         values.get('video'), values.get('size'), attempts,
+                         time.time()))
+            if talk >= next_id:
+                next_id = talk + 1
+                misses = misses + 1 if state == 'missing' else 0
+        with self.__db:
+            self.__db.executemany('INSERT OR REPLACE INTO talks VALUES '
+                                  '(?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.__db.executemany('UPDATE checkpoint SET value = ? WHERE '
+                                  'name = ?', ((next_id, 'next'),
+                                               (misses, 'misses')))
+        return errors
+
+    def work(self, size=CATALOG_WINDOW):
+        """The next talks to download, oldest first, a list of CatalogEntry.
+        """
+        return [CatalogEntry(*row) for row in self.__db.execute(
+            'SELECT id, title, page, published, video, size FROM talks WHERE '
+            'state = ? ORDER BY id LIMIT ?', ('queued', size))]
+
+    def finish(self, states, retries=CATALOG_RETRIES):
+        """Store the result of downloading some talks.
+
+        (dict) states -- the new state of every talk by its id, 'done',
+                         'skipped' or 'queued' if it has to be tried again
+
+        """
+        with self.__db:
+            for talk, state in states.items():
+                self.__db.execute('UPDATE talks SET state = ?, attempts = '
+                                  'attempts + ?, updated = ? WHERE id = ?',
+                                  (state, state == 'queued', time.time(),
+                                   talk))
+            self.__db.execute('UPDATE talks SET state = ? WHERE state = ? '
+                              'AND attempts >= ?', ('failed', 'queued',
+                                                    retries))
+
+    def counts(self):
+        """The number of talks by state, a dict."""
+        return dict(self.__db.execute('SELECT state, COUNT(*) FROM talks '
+                                      'GROUP BY state'))
+
+    def close(self):
+        """Close the queue's database."""
+        self.__db.close()
+
+
+class Leases():
+    """
+
+    Leases of the talks downloaded to a folder shared by several hosts.
+
+    Before a host downloads a talk (its video or its subtitles), it claims the
+    talk's lease: a lock file next to the video ('<video>.lease') with the
+    owner (the host and the process) and the time when it expires. The file
+    is created by a hard link from a temporary one, that fails if it already
+    exists, even on NFS, so only one host gets the lease and the talk is
+    downloaded only once. The leases held are renewed in the background
+    while the talks are downloaded and removed when they finish. If a host
+    dies, its leases expire and another host takes them over (and resumes the
+    interrupted videos).
+
+    Every change of a lease that already exists (to renew, take over or
+    remove it) is made holding its mutex, a directory ('<video>.lease.lock',
+    mkdir is atomic too), so two hosts never take over the same lease and an
+    owner never renews a lease already taken over. The clocks of the hosts
+    must agree within a small part of the lease's time.
+
+    """
+
+    def __init__(self, ttl=LEASE_TTL, owner=None):
+        """Create the leases of this process, none held yet.
 
-        # initialize the mail server
-        server = smtplib.SMTP()
-        # Connect to mail server
+        (int) ttl -- the seconds that a lease lasts if it's not renewed
+        (str) owner -- the owner of the leases, by default the host's name and
+                       the process' id
+
+        """
+        self.ttl = ttl
+        self.owner = owner or '{0}:{1}'.format(socket.gethostname(),
+                                               os.getpid())
+        self.lost = []
+        self.__held = set()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __read(self, lease):
+        """The owner & the expiry time of a lease, (None, 0) if it doesn't
+        exist."""
+        try:
+            with open(lease) as lease_file:
+                data = json.load(lease_file)
+            return data['owner'], data['expires']
+        except (IOError, ValueError, KeyError):
+            return None, 0
+
+    def __temp(self, lease):
+        """Write a lease of this process in a temporary file, return its
+        name."""
+        tmp_name = '{0}.{1}.tmp'.format(lease, self.owner.replace(':', '.'))
+        with open(tmp_name, 'w') as tmp_file:
+            json.dump({'owner': self.owner,
+                       'expires': time.time() + self.ttl}, tmp_file)
+        return tmp_name
+
+    def __break(self, mutex):
+        """Remove a mutex left by a host that died holding it (older than a
+        lease's time).
+
+        It's renamed first to a name of this process, so only one of the
+        hosts that find it stale removes it. If it turns out to be a new one
+        (another host broke the stale one and took the mutex in between), it's
+        put back.
+
+        """
+        stale = '{0}.{1}.stale'.format(mutex, self.owner.replace(':', '.'))
         try:
-            server.connect(mail_server)
-        except socket.gaierror:
-            self.list('mail error', 'Wrong server, are you sure is correct?')
-        except socket.error:
-            self.list('mail error', 'Server unavailable or connection refused')
-        # Login in mail server
-        if mail_server != 'localhost':
+            if time.time() - os.path.getmtime(mutex) <= self.ttl:
+                return
+            os.rename(mutex, stale)
+            if time.time() - os.path.getmtime(stale) > self.ttl:
+                os.rmdir(stale)
+            elif not os.path.exists(mutex):
+                os.rename(stale, mutex)
+        except OSError:
+            # Gone, or broken by another host
+            pass
+
+    @contextlib.contextmanager
+    def __mutex(self, lease, wait=2.0):
+        """Hold the mutex of a lease, yield False if it's held by another
+        host for longer than the wait."""
+        mutex = '{0}.lock'.format(lease)
+        deadline = time.time() + wait
+        while True:
             try:
-                server.login(server_user, server_pass)
-            except smtplib.SMTPAuthenticationError:
-                self.list('mail error', 'Authentication error')
-            except smtplib.SMTPException:
-                self.list('mail error', 'No suitable authentication method')
-        # Send mail
+                os.mkdir(mutex)
+                break
+            except OSError:
+                self.__break(mutex)
+            if time.time() > deadline:
+                yield False
+                return
+            time.sleep(0.01 + random.random() * 0.04)
+        try:
+            yield True
+        finally:
+            try:
+                os.rmdir(mutex)
+            except OSError:
+                # Broken by another host, this one was stalled for too long
+                pass
+
+    def claim(self, name):
+        """Claim a lease, return False if another host holds it.
+
+        (str) name -- the name of the lease, e.g. the video's
+
+        """
+        lease = '{0}.lease'.format(name)
+        tmp_name = self.__temp(lease)
         try:
-            server.sendmail(send_from, dest_to_addrs, message.as_string())
-        except smtplib.SMTPRecipientsRefused:
-            self.list('mail error', 'All recipients were refused.'
-                      'Nobody got the mail.')
-        except smtplib.SMTPSenderRefused:
-            self.list('mail error', 'The server didn’t accept the from_addr')
-        except smtplib.SMTPDataError:
-            self.list('mail error', 'An unexpected error code, Data refused')
-        # Disconnect from server
-        server.quit()
+            try:
+                os.link(tmp_name, lease)
+            except OSError:
+                # It exists, take it over only if it has expired
+                with self.__mutex(lease) as locked:
+                    owner, expires = self.__read(lease)
+                    if not locked or (owner != self.owner and
+                                      expires > time.time()):
+                        return False
+                    os.rename(tmp_name, lease)
+                    if owner not in (None, self.owner):
+                        METRICS.count('leases taken over')
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+        with self.__lock:
+            self.__held.add(name)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__heartbeat)
+                self.__thread.daemon = True
+                self.__thread.start()
+        return True
+
+    def __heartbeat(self):
+        """Renew the leases held, four times in a lease's time."""
+        while not self.__stop.wait(self.ttl / 4.0):
+            self.renew()
+
+    def renew(self):
+        """Extend the leases held, the ones taken over by another host (this
+        host was stalled for longer than a lease's time) are lost."""
+        with self.__lock:
+            names = list(self.__held)
+        for name in names:
+            lease = '{0}.lease'.format(name)
+            with self.__mutex(lease) as locked:
+                if not locked:
+                    continue
+                if self.__read(lease)[0] == self.owner:
+                    os.rename(self.__temp(lease), lease)
+                else:
+                    with self.__lock:
+                        self.__held.discard(name)
+                        self.lost.append(name)
+
+    def release(self, name=None):
+        """Remove the lease of a job, or all of them (None), if this process
+        still holds it."""
+        with self.__lock:
+            names = list(self.__held) if name is None else [name]
+            self.__held.difference_update(names)
+        for name in names:
+            lease = '{0}.lease'.format(name)
+            with self.__mutex(lease) as locked:
+                if locked and self.__read(lease)[0] == self.owner:
+                    os.remove(lease)
+
+    def close(self):
+        """Stop renewing the leases and remove all of them."""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.release()
+
+
+class Metrics():
+    """
+
+    Timers and counters of the phases of a run and of every talk.
+
+    The phases (feed fetch, feed parse, talk pages, subtitles, videos...) sum
+    the seconds of all their calls, even if they run at the same time in
+    several threads. The HTTP requests made while a talk is being processed,
+    by the same thread, are counted for that talk (see talk()). A run that
+    never ends (see watch()) rolls the talks up into their totals after every
+    poll, so it only keeps the ones of the last poll.
+
+    """
+
+    def __init__(self):
+        """Create the empty timers and counters."""
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__start = time.time()
+        self.__phases = {}
+        self.__counters = {}
+        self.__talks = {}
+        self.__rolled = {}
+
+    @contextlib.contextmanager
+    def timer(self, phase, size=0):
+        """Time the block of a 'with' statement as a call to a phase.
+
+        (str) phase -- the name of the phase
+        (int) size -- the bytes processed by the block, if any
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start, size)
+
+    def add(self, phase, seconds, size=0):
+        """Add a call to a phase, with its seconds and bytes processed."""
+        with self.__lock:
+            values = self.__phases.setdefault(phase, {'calls': 0,
+                                                      'seconds': 0.0,
+                                                      'bytes': 0})
+            values['calls'] += 1
+            values['seconds'] += seconds
+            values['bytes'] += size
+
+    def count(self, counter, value=1):
+        """Increase a counter."""
+        with self.__lock:
+            self.__counters[counter] = self.__counters.get(counter, 0) + value
+
+    @contextlib.contextmanager
+    def talk(self, name):
+        """Attribute to a talk the requests made inside a 'with' block."""
+        previous = getattr(self.__local, 'talk', None)
+        self.__local.talk = name
+        try:
+            yield
+        finally:
+            self.__local.talk = previous
+
+    def talk_values(self, name, **values):
+        """Add values to a talk (e.g. bytes, seconds)."""
+        with self.__lock:
+            talk = self.__talks.setdefault(name, {})
+            for key, value in values.items():
+                talk[key] = talk.get(key, 0) + value
+
+    def roll_up(self):
+        """Add the values of the talks to their totals and drop them."""
+        with self.__lock:
+            for values in self.__talks.values():
+                self.__rolled['talks'] = self.__rolled.get('talks', 0) + 1
+                for key, value in values.items():
+                    self.__rolled[key] = self.__rolled.get(key, 0) + value
+            self.__talks = {}
+
+    def request(self, status, retries):
+        """Count a HTTP request, its status and retries (HTTPPool observer)."""
+        self.count('http {0}'.format(status))
+        self.count('http retries', retries)
+        name = getattr(self.__local, 'talk', None)
+        if name:
+            self.talk_values(name, **{'http {0}'.format(status): 1,
+                                      'http retries': retries})
+
+    def get(self):
+        """Get all the metrics as a dictionary."""
+        with self.__lock:
+            phases = dict((phase, dict(values)) for phase, values in
+                          self.__phases.items())
+            talks = dict((name, dict(values)) for name, values in
+                         self.__talks.items())
+            counters = dict(self.__counters)
+            rolled = dict(self.__rolled)
+        for values in phases.values() + talks.values() + [rolled]:
+            if values.get('bytes') and values.get('seconds'):
+                values['MB/s'] = values['bytes'] / 1e6 / values['seconds']
+        return {'start': self.__start, 'seconds': time.time() - self.__start,
+                'phases': phases, 'counters': counters, 'talks': talks,
+                'rolled up': rolled}
+
+    def summary(self):
+        """The metrics as lines of text, for the log."""
+        metrics = self.get()
+        lines = ['{0:<20} {1:>10.2f} s'.format('run', metrics['seconds'])]
+        for phase, values in sorted(metrics['phases'].items()):
+            line = '{0:<20} {1:>10.2f} s {2:>6} calls'.format(
+                phase, values['seconds'], values['calls'])
+            if values['bytes']:
+                size = best_unit_size(values['bytes'])
+                line += ' {0:>9.2f} {1:<5} {2:>8.2f} MB/s'.format(
+                    size['s'], size['u'], values.get('MB/s', 0))
+            lines.append(line)
+        if metrics['counters']:
+            lines.append('')
+            lines.extend('{0:<20} {1:>10}'.format(counter, value) for
+                         counter, value in sorted(metrics['counters'].items()))
+        talks = sorted(metrics['talks'].items())
+        if metrics['rolled up']:
+            talks.insert(0, ('talks of the previous polls',
+                             metrics['rolled up']))
+        for name, values in talks:
+            lines.append('')
+            lines.append(name)
+            lines.extend('    {0:<16} {1:>10}'.format(
+                key, '{0:.2f}'.format(value) if isinstance(value, float) else
+                value) for key, value in sorted(values.items()))
+        return lines
+
+    def write(self, filename):
+        """Write the metrics to a JSON file."""
+        with open(filename, 'wb') as json_file:
+            json.dump(self.get(), json_file, indent=2, sort_keys=True)
+
+
+# the metrics of the run
+METRICS = Metrics()
+
+
+class RateLimiter():
+    """
+
+    A token bucket that limits the bandwidth of all the transfers together.
+
+    The rate can change with the time of the day (e.g. less bandwidth during
+    office hours). The transfers of the urgent priority (subtitles, pages,
+    the feed...) never wait: they take their tokens at once, even in debt, and
+    the videos pay that debt waiting a bit more. So the small fetches end in
+    milliseconds while the big downloads are running.
+
+    """
+
+    def __init__(self, rate=0, schedule=()):
+        """Create the bucket.
+
+        (int) rate -- bytes per second, 0 is no limit
+        (iterable) schedule -- (start, end, rate) for some times of the day,
+                               start & end in minutes since midnight
+
+        """
+        self.__lock = threading.Lock()
+        self.__tokens = 0.0
+        self.__time = time.time()
+        self.configure(rate, schedule)
+
+    def configure(self, rate=0, schedule=()):
+        """Set the rate (bytes per second) and the rates by time of day."""
+        with self.__lock:
+            self.__rate = rate
+            self.__schedule = list(schedule)
+
+    def rate(self):
+        """The rate of this moment, in bytes per second (0 is no limit)."""
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.__schedule:
+            if (start <= minute < end if start <= end else
+                    minute >= start or minute < end):
+                return rate
+        return self.__rate
+
+    def limited(self):
+        """True if there's any limit, now or at any time of the day."""
+        return bool(self.__rate or any(rate for _, _, rate in
+                                       self.__schedule))
+
+    def consume(self, size, priority=PRIORITY_VIDEO):
+        """Take the tokens for a number of bytes, waiting for them if needed.
+
+        (int) size -- the bytes transferred
+        (int) priority -- the priority of the transfer, only PRIORITY_URGENT
+                          never waits
+
+        """
+        rate = self.rate()
+        if not rate:
+            return
+        with self.__lock:
+            now = time.time()
+            # one second of burst at most
+            self.__tokens = min(rate, self.__tokens +
+                                (now - self.__time) * rate)
+            self.__time = now
+            self.__tokens -= size
+            wait = -self.__tokens / rate
+        if wait > 0 and priority != PRIORITY_URGENT:
+            time.sleep(wait)
+
+
+def parse_schedule(schedule):
+    """Convert a schedule like '08:00-20:00=500K,20:00-08:00=0' to a list of
+    (start, end, rate), with start & end in minutes since midnight."""
+    rates = []
+    for window in (part for part in schedule.split(',') if part.strip()):
+        hours, rate = window.split('=')
+        start, end = (int(hour) * 60 + int(mins) for hour, mins in
+                      (moment.strip().split(':') for moment in
+                       hours.split('-')))
+        rates.append((start, end, parse_size(rate)))
+    return rates
+
+
+# the limit of bandwidth shared by all the transfers
+LIMITER = RateLimiter()
+
+# the code shared with TEDSubs.py counts its requests and its phases in the
+# metrics of the run, and its transfers (the pages & the subtitles) share the
+# bandwidth as urgent ones
+HTTP.observer = METRICS.request
+METER.configure(METRICS, lambda size: LIMITER.consume(size, PRIORITY_URGENT))
+
+
+class QualityPolicy():
+    """
+
+    Choice of the variant (quality) of every video downloaded.
+
+    The variants of a talk are its own video (the HD feed's, 'hd') and the
+    ones of its web page ('high', 'medium' & 'low', see scrape_page()). The
+    preferred one is chosen if it's available and fits, if not, the lower
+    ones in order, then the higher ones. A variant fits if it's not larger
+    than the bytes by talk and the bytes left of the run's budget. The sizes
+    are the feed's or asked for by HEAD requests, and kept in the talks'
+    cache. The web page is read only if the policy is not the default one.
 
-    def write(self, append=False):
-        """Write the log to a file.
+    An interrupted video is resumed in the same variant, the one in its
+    '<video>.part.variant' file (the talk's own one if there's none).
 
-        The name of the file will be like this:
+    """
+
+    def __init__(self, quality='hd', max_size=0, budget=0, upgrade=False):
+        self.__lock = threading.Lock()
+        self.configure(quality, max_size, budget, upgrade)
+
+    def configure(self, quality='hd', max_size=0, budget=0, upgrade=False):
+        """Set the policy.
+
+        (str) quality -- the preferred quality, see QUALITIES
+        (int) max_size -- the bytes of a video at most, 0 is no limit
+        (int) budget -- the bytes of the videos of a run at most, 0 is no limit
+        (bool) upgrade -- download again the videos of lower qualities
+
+        """
+        with self.__lock:
+            self.quality = quality
+            self.max_size = max_size
+            self.budget = budget
+            self.upgrade = upgrade
+            self.spent = 0
+
+    def settings(self):
+        """The policy as a tuple, to know if it changes between runs."""
+        return self.quality, self.max_size, self.budget, self.upgrade
+
+    def new_run(self):
+        """Start the budget of a new run (e.g. a poll of the feed)."""
+        with self.__lock:
+            self.spent = 0
+
+    def default(self):
+        """True if the talk's own video is always chosen."""
+        return self.quality == 'hd' and not self.max_size and not self.budget
+
+    def order(self):
+        """The qualities in the order they are tried."""
+        idx = QUALITIES.index(self.quality)
+        return QUALITIES[idx:] + QUALITIES[:idx][::-1]
+
+    def better(self, variant):
+        """True if a video of a quality has to be upgraded."""
+        return (self.upgrade and variant in QUALITIES and
+                QUALITIES.index(variant) > QUALITIES.index(self.quality))
+
+    def __size(self, ttk, quality, url, talk, cache):
+        """The bytes of a variant, None if it's missing."""
+        if quality == ttk.quality:
+            return ttk.video_size
+        sizes = talk.setdefault('sizes', {})
+        if quality not in sizes:
+            try:
+                length = HTTP.head(url).getheader('Content-Length')
+            except urllib2.HTTPError:
+                length = None
+            except (IOError, httplib.HTTPException):
+                # Not known now, but maybe the next time
+                return None
+            sizes[quality] = int(length) if length else None
+            cache.put(talk)
+        return sizes[quality]
+
+    def choose(self, ttk, vid_name, cache, stored=None):
+        """Choose the variant of a talk's video and take its bytes from the
+        budget.
+
+        (FeedEntry) ttk -- the talk (or a CatalogEntry)
+        (str) vid_name -- the name of the talk's video
+        (TalkCache) cache -- the talks' values, with the variants' sizes
+        (str) stored -- the quality of the video stored, only the better ones
+                        are chosen (None if it isn't stored)
+
+        Returns the quality, the url and the size of the variant, or None if
+        none fits in the budget. Raises an IOError if none is available or
+        fits in the bytes by talk.
+
+        """
+        part_name = '{0}.part'.format(vid_name)
+        variant_name = '{0}.variant'.format(part_name)
+        urls, talk = {ttk.quality: ttk.video_url}, {}
+        if not self.default():
+            talk = talk_values(cache, ttk.id, ttk.link)
+            urls = dict(talk['urls'], **urls)
+        qualities = [quality for quality in self.order() if quality in urls
+                     and (stored not in QUALITIES or QUALITIES.index(quality)
+                          < QUALITIES.index(stored))]
+        # An interrupted video goes on in its variant, if it still fits
+        part_quality = None
+        if os.path.exists(part_name):
+            part_quality = ttk.quality
+            if os.path.exists(variant_name):
+                with open(variant_name) as variant_file:
+                    part_quality = variant_file.read().strip()
+            if part_quality in qualities:
+                qualities.remove(part_quality)
+                qualities.insert(0, part_quality)
+        over_budget = False
+        for quality in qualities:
+            size = self.__size(ttk, quality, urls[quality], talk, cache)
+            if not size or (self.max_size and size > self.max_size):
+                continue
+            resumed = (os.path.getsize(part_name) if quality == part_quality
+                       else 0)
+            with self.__lock:
+                if self.budget and self.spent + size - resumed > self.budget:
+                    over_budget = True
+                    continue
+                self.spent += size - resumed
+            if part_quality is not None and quality != part_quality:
+                # The bytes of another variant are useless, start over
+                for name in (part_name, '{0}.hash'.format(part_name)):
+                    if os.path.exists(name):
+                        os.remove(name)
+            # Even the talk's own one, as the video may be resumed from its
+            # web page (see Downloader.poll())
+            with open(variant_name, 'w') as variant_file:
+                variant_file.write(quality)
+            return quality, urls[quality], size
+        if over_budget or stored:
+            return None
+        if talk:
+            # The urls (or the sizes) kept of the talk's page may be stale,
+            # the next run reads it again
+            cache.invalidate(ttk.id)
+        if self.max_size:
+            raise IOError('No variant of the video fits in {0} bytes'.
+                          format(self.max_size))
+        raise IOError('No variant of the video is available')
+
+
+QUALITY = QualityPolicy()
+
+
+class Checksum():
+    """
 
-        script.log
+    The checksum of a file computed while its bytes are written, by blocks.
 
-        where 'script' is the name of the script file without extension (.py)
+    The file is split in blocks of HASH_BLOCK bytes, every block is hashed
+    (SHA-1) as its bytes are written, one after another inside every block
+    but in any order between blocks, and the checksum is the SHA-1 of the
+    blocks' hashes. So the segments of a download are hashed at the same time
+    and the file is never read again. The hashes of the complete blocks are
+    saved in a '.hash' file, to resume an interrupted download without
+    reading the bytes already downloaded.
 
-        (boolean) append -- If true appends log to file, else writes a new one
+    """
+
+    def __init__(self, size, filename=None):
+        """Create the checksum of a file, loading the blocks already hashed.
+
+        (int) size -- the bytes of the whole file
+        (str) filename -- the file to save the hashes of the blocks (if any)
 
         """
-        mode = 'ab' if append else 'wb'
-        with open(self.filename, mode) as log_file:
-            log_file.write(self.__log)
+        self.size = size
+        self.filename = filename
+        self.__blocks = {}
+        self.__open = {}
+        self.__lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as hash_file:
+                    saved = pickle.load(hash_file)
+                if saved['size'] == size:
+                    self.__blocks = saved['blocks']
+            except (EOFError, IOError, KeyError, pickle.PickleError):
+                pass
+
+    def __length(self, idx):
+        """The bytes of a block, the last one may be shorter."""
+        return min(HASH_BLOCK, self.size - idx * HASH_BLOCK)
+
+    def update(self, offset, data):
+        """Hash the bytes written at an offset of the file."""
+        with self.__lock:
+            while data:
+                idx, pos = divmod(offset, HASH_BLOCK)
+                piece = data[:self.__length(idx) - pos]
+                if pos == 0:
+                    self.__open[idx] = [hashlib.sha1(), 0]
+                    self.__blocks.pop(idx, None)
+                if idx in self.__open and self.__open[idx][1] == pos:
+                    self.__open[idx][0].update(piece)
+                    self.__open[idx][1] += len(piece)
+                    if self.__open[idx][1] == self.__length(idx):
+                        self.__blocks[idx] = self.__open.pop(idx)[0].digest()
+                        self.__save()
+                else:
+                    # Not one after another, this block can't be hashed
+                    self.__open.pop(idx, None)
+                offset += len(piece)
+                data = data[len(piece):]
+
+    def read(self, name, size=None):
+        """Hash the first bytes of a file (all if no size), reading them."""
+        size = self.size if size is None else size
+        with open(name, 'rb') as a_file:
+            for offset in range(0, size, HASH_BLOCK):
+                block = a_file.read(min(HASH_BLOCK, size - offset))
+                if not block:
+                    break
+                self.update(offset, block)
+
+    def safe_size(self):
+        """The bytes from the beginning of the file of the complete blocks."""
+        idx = 0
+        while idx in self.__blocks:
+            idx += 1
+        return min(idx * HASH_BLOCK, self.size)
+
+    def truncate(self, size):
+        """Forget the blocks past a size, e.g. when the file is cut."""
+        with self.__lock:
+            self.__open.clear()
+            for idx in list(self.__blocks):
+                if idx * HASH_BLOCK + self.__length(idx) > size:
+                    del self.__blocks[idx]
+            self.__save()
+
+    def hexdigest(self):
+        """The checksum of the whole file (None if some block is missing)."""
+        blocks = -(-self.size // HASH_BLOCK)
+        if any(idx not in self.__blocks for idx in range(blocks)):
+            return None
+        return hashlib.sha1(''.join(self.__blocks[idx] for idx in
+                                    range(blocks))).hexdigest()
+
+    def __save(self):
+        """Save the hashes of the complete blocks, if there's a file."""
+        if self.filename:
+            tmp_name = '{0}.tmp'.format(self.filename)
+            with open(tmp_name, 'wb') as hash_file:
+                pickle.dump({'size': self.size, 'blocks': self.__blocks},
+                            hash_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_name, self.filename)
+
+    def remove(self):
+        """Remove the file of the hashes of the blocks."""
+        if self.filename and os.path.exists(self.filename):
+            os.remove(self.filename)
 
 
 def arguments():
@@ -266,28 +1816,107 @@ def arguments():
     parser = ArgumentParser(description=desc)
     parser.add_argument("path", default=os.getcwd(), nargs='?',
                         help="The path to store the TED Talks videos")
+    parser.add_argument("-j", "--video-jobs", type=int, default=2,
+                        metavar="N",
+                        help="number of videos downloaded at the same time")
+    parser.add_argument("-s", "--sub-jobs", type=int, default=4,
+                        metavar="N",
+                        help="number of talks whose subtitles are downloaded "
+                        "at the same time")
+    parser.add_argument("-g", "--segments", type=int, default=1,
+                        metavar="N",
+                        help="download every video by N connections at the "
+                        "same time")
+    parser.add_argument("-b", "--rate", default="0",
+                        help="limit of bandwidth for all the downloads "
+                        "together, in bytes per second, e.g. 500K or 2M "
+                        "(default: 0, no limit)")
+    parser.add_argument("-t", "--schedule", default="", metavar="RATES",
+                        help="limits of bandwidth by time of day, comma "
+                        "separated, e.g. 08:00-20:00=500K,20:00-08:00=0")
+    parser.add_argument("-l", "--languages", default="eng,spa",
+                        metavar="LANGS",
+                        help="comma separated languages of the subtitles "
+                        "(default: eng,spa)")
+    parser.add_argument("-m", "--no-mail", action="store_true",
+                        help="don't send the log by mail")
+    parser.add_argument("--mail-server", default="localhost",
+                        metavar="HOST[:PORT]",
+                        help="smtp server to send the log (default: "
+                        "localhost)")
+    parser.add_argument("--digest", type=float, default=0, metavar="HOURS",
+                        help="hours between mails at least, the logs of the "
+                        "runs between them are sent together (default: 0, a "
+                        "mail by run)")
+    parser.add_argument("-Q", "--quality", default="hd", choices=QUALITIES,
+                        help="preferred quality of the videos, the HD feed's "
+                        "or the ones of the talks' pages, the nearest one is "
+                        "taken if it's missing or too large (default: hd)")
+    parser.add_argument("--max-size", default="0", metavar="SIZE",
+                        help="bytes of a video at most, e.g. 300M, a smaller "
+                        "quality is taken if it's larger (default: 0, no "
+                        "limit)")
+    parser.add_argument("--budget", default="0", metavar="SIZE",
+                        help="bytes of the videos downloaded by a run, e.g. "
+                        "2G, the rest are left for the next runs (default: "
+                        "0, no limit)")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="download again the videos of the feed stored "
+                        "in a lower quality than the preferred one")
+    parser.add_argument("-q", "--quota", default="0", metavar="SIZE",
+                        help="space for the videos and subtitles, e.g. 200G, "
+                        "the talks are evicted (removed) to make room for "
+                        "the new ones (default: 0, no limit)")
+    parser.add_argument("-e", "--evict", default="oldest",
+                        choices=('oldest', 'unused', 'nolang'),
+                        help="talks evicted first: the oldest published, the "
+                        "least recently watched or the ones without "
+                        "subtitles (default: oldest)")
+    parser.add_argument("-f", "--log-format", choices=('text', 'json'),
+                        default='text',
+                        help="format of the log file, text or a JSON object "
+                        "by line (default: text)")
+    parser.add_argument("--log-size", default="1M", metavar="SIZE",
+                        help="size of the log file to rotate it (default: "
+                        "1M)")
+    parser.add_argument("--log-age", type=int, default=30, metavar="DAYS",
+                        help="days of the log file to rotate it (default: "
+                        "30)")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="keep running and poll the feed, more often "
+                        "around the hours when TED usually publishes")
+    parser.add_argument("--poll", default="5,120", metavar="MIN,MAX",
+                        help="minutes between polls of the feed in watch "
+                        "mode, when it changes and at most (default: 5,120)")
+    parser.add_argument("--summary", type=float, default=24, metavar="HOURS",
+                        help="hours between the summaries sent by mail in "
+                        "watch mode (default: 24)")
+    parser.add_argument("-a", "--catalog", action="store_true",
+                        help="download all the talks of TED, not only the "
+                        "feed's (instead of reading it), an interrupted sync "
+                        "goes on from where it was left")
+    parser.add_argument("-d", "--distributed", action="store_true",
+                        help="share the folder with other hosts that download "
+                        "the feed to it, every talk is downloaded once, by "
+                        "the host that claims its lease")
+    parser.add_argument("--lease", type=int, default=LEASE_TTL,
+                        metavar="SECONDS",
+                        help="seconds of a lease in distributed mode, the "
+                        "talks of a host that died are taken over after it "
+                        "(default: {0})".format(LEASE_TTL))
+    parser.add_argument("-c", "--verify", action="store_true",
+                        help="check the sizes and checksums of the videos "
+                        "and subtitles (instead of downloading), the wrong "
+                        "ones are downloaded again by the next run")
+    parser.add_argument("-r", "--rebuild-index", action="store_true",
+                        help="index again the videos and subtitles of the "
+                        "folder, e.g. after removing some by hand")
     parser.add_argument("-v", "--version", action="version",
                         version="%(prog)s {0}".format(__version__),
                         help="show program's version number and exit")
     return parser
 
 
-def check_exec_posix(prog):
-    """Check if the program is installed in a *NIX platform.
-
-    Returns one value:
-
-    (boolean) found - True if the program is installed
-
-    """
-    found = True
-    try:
-        Popen([prog, '--help'], stdout=PIPE, stderr=PIPE)
-    except OSError:
-        found = False
-    return found
-
-
 def best_unit_size(bytes_size):
     """Get a size in bytes & convert it to the best IEC prefix for readability.
 
@@ -307,125 +1936,1168 @@ def best_unit_size(bytes_size):
     return {'s': bu_size, 'u': unit, 'b': bytes_size}
 
 
-def get_size(the_path):
-    """Get size of a directory tree or a file in bytes."""
-    path_size = 0
-    for path, directories, files in os.walk(the_path):
-        for filename in files:
-            path_size += os.lstat(os.path.join(path, filename)).st_size
-        for directory in directories:
-            path_size += os.lstat(os.path.join(path, directory)).st_size
-    path_size += os.path.getsize(the_path)
-    return path_size
-
-
-def get_sub(tt_id, tt_intro, sub):
-    """Get TED Subtitle in JSON format & convert it to SRT Subtitle."""
-
-    def srt_time(tst):
-        """Format Time from TED Subtitles format to SRT time Format."""
-        secs, mins, hours = ((tst / 1000) % 60), (tst / 60000), (tst / 3600000)
-        right_srt_time = ("{0:02d}:{1:02d}:{2:02d},{3:3.0f}".
-                          format(int(hours), int(mins), int(secs),
-                                 divmod(secs, 1)[1] * 1000))
-        return right_srt_time
-
-    srt_content = ''
-    sub_log = ''
-    tt_url = 'http://www.ted.com/talks'
-    sub_url = '{0}/subtitles/id/{1}/lang/{2}'.format(tt_url, tt_id, sub[-7:-4])
-    # Get JSON sub
-    if FOUND:
-        json_file = Popen(['wget', '-q', '-O', '-', sub_url],
-                          stdout=PIPE).stdout.readlines()
-
-        if json_file:
-            for line in json_file:
-                if line.find('captions') == -1 and line.find('status') == -1:
-                    json_file.remove(line)
-        else:
-            sub_log += "Subtitle '{0}' not found.{1}".format(sub, os.linesep)
+def load_state(filename='.data.pkl'):
+    """Load the state saved by the previous run.
+
+    Returns a dictionary with these keys:
+
+    'version' -- (int) the version of the state's format
+    'last' -- (time.struct_time) the date of the last talk downloaded
+    'etag' -- (str) the ETag header of the last feed read (or None)
+    'modified' -- (str) the Last-Modified header of the last feed (or None)
+    'expires' -- (float) the time until the last feed read is fresh, so it's
+                 not asked for again before (see fresh_until())
+    'quality' -- (tuple) the quality policy of the last run (see
+                 QualityPolicy.settings())
+
+    The first versions only stored the 'last' date, they are upgraded.
+
+    """
+    state = {'version': STATE_VERSION, 'etag': None, 'modified': None,
+             'expires': 0, 'last': time.localtime(time.time() - 86400),
+             'quality': QualityPolicy().settings()}
+    try:
+        with open(filename, 'rb') as pkl_file:
+            saved = pickle.load(pkl_file)
+    except (EOFError, IOError, pickle.PickleError):
+        return state
+    if isinstance(saved, dict):
+        state.update(saved)
     else:
-        json_file = urllib2.urlopen(sub_url).readlines()
-    if json_file:
-        try:
-            json_object = json.loads(json_file[0])
-            if 'captions' in json_object:
-                caption_idx = 1
-                if not json_object['captions']:
-                    sub_log += ("Subtitle '{0}' not available.{1}".
-                                format(sub, os.linesep))
-                for caption in json_object['captions']:
-                    start = tt_intro + caption['startTime']
-                    end = start + caption['duration']
-                    idx_line = '{0}'.format(caption_idx)
-                    time_line = '{0} --> {1}'.format(srt_time(start),
-                                srt_time(end))
-                    text_line = '{0}'.format(caption['content'].
-                                             encode('utf-8'))
-                    srt_content += '\n'.join([idx_line, time_line, text_line,
-                                             '\n'])
-                    caption_idx += 1
-            elif 'status' in json_object:
-                sub_log += ("This is an error message returned by TED:{0}{0} "
-                            "- {1} {0}{0}Probably because the subtitle '{2}' "
-                            "is not available.{0}{0}{0}"
-                            "".format(os.linesep,
-                                      json_object['status']['message'],
-                                      sub))
-
-        except ValueError:
-            sub_log += ("Subtitle '{0}' it's a malformed json file.{1}".
-                        format(sub, os.linesep))
-    return srt_content, sub_log
-
-
-def check_subs(ttalk, v_name):
+        state['last'] = saved
+    state['version'] = STATE_VERSION
+    return state
+
+
+def save_state(state, filename='.data.pkl'):
+    """Save the state for the next run, never leaving a half written file."""
+    fd, tmp_name = tempfile.mkstemp('.tmp', filename, '.')
+    with os.fdopen(fd, 'wb') as pkl_file:
+        pickle.dump(state, pkl_file)
+    os.rename(tmp_name, filename)
+
+
+def fresh_until(response):
+    """The time until a response is fresh, by its caching headers.
+
+    (httplib.HTTPResponse) response -- the response, e.g. the feed's
+
+    The Cache-Control's max-age (less the Age of the response) comes first,
+    then the Expires header (relative to the Date). It's 0 (stale) if the
+    response mustn't be cached or it hasn't any of them.
+
+    """
+    now = time.time()
+    control = (response.getheader('Cache-Control') or '').lower()
+    if 'no-cache' in control or 'no-store' in control:
+        return 0
+    max_age = re.search(r'max-age=(\d+)', control)
+    if max_age:
+        age = response.getheader('Age') or '0'
+        return now + int(max_age.group(1)) - (int(age) if age.isdigit() else 0)
+    expires = email_utils.parsedate_tz(response.getheader('Expires') or '')
+    date = email_utils.parsedate_tz(response.getheader('Date') or '')
+    if expires and date:
+        return (now + email_utils.mktime_tz(expires) -
+                email_utils.mktime_tz(date))
+    return 0
+
+
+def talk_values(cache, tt_id, tt_page):
+    """Get the values of a talk from the cache or, if not, from its web page.
+
+    Returns a dictionary like the ones stored by TalkCache.put()
+
+    """
+    talk = cache.get(tt_id)
+    if talk is None:
+        values = read_page(tt_page)
+        talk = {'id': tt_id, 'page': tt_page, 'intro': values['intro'],
+                'urls': values['urls']}
+        cache.put(talk)
+    return talk
+
+
+class FeedEntry():
+    """
+
+    A talk of the RSS feed, only the values needed of its item.
+
+    """
+
+    def __init__(self, item):
+        """Read the values of a RSS item (an ElementTree element).
+
+        Raises a ValueError if the item lacks some of them.
+
+        """
+        video = item.find('{0}content'.format(NS_MEDIA))
+        published = email_utils.parsedate_tz(item.findtext('pubDate', ''))
+        if video is None or published is None or not item.findtext('guid'):
+            raise ValueError('Malformed feed item: {0}'.
+                             format(item.findtext('title')))
+        self.id = int(item.findtext('guid').split(':')[-1])
+        self.title = item.findtext('{0}subtitle'.format(NS_ITUNES), u'')
+        self.duration = item.findtext('{0}duration'.format(NS_ITUNES), u'')
+        self.link = item.findtext('{0}origLink'.format(NS_FEEDBURNER),
+                                  item.findtext('link'))
+        self.summary = item.findtext('{0}encoded'.format(NS_CONTENT),
+                                     item.findtext('description', u''))
+        self.published_parsed = time.gmtime(email_utils.mktime_tz(published))
+        self.video_url = video.get('url')
+        self.video_size = int(video.get('fileSize'))
+        self.quality = 'hd'
+
+
+class CatalogEntry():
+    """
+
+    A talk of the catalog (see Catalog), with the same values as a FeedEntry,
+    but the ones not found in its web page are empty.
+
+    """
+
+    def __init__(self, talk, title, page, published, video, size):
+        """Create the talk from its row of the catalog's queue."""
+        self.id = talk
+        self.title = title or u''
+        self.duration = u''
+        self.link = page
+        self.summary = u''
+        self.published_parsed = (time.gmtime(published) if published else
+                                 None)
+        self.video_url = video
+        self.video_size = size
+        self.quality = 'high'
+
+
+def scrape_talk(cache, talk):
+    """Read the values of a talk of the catalog from its web page.
+
+    (TalkCache) cache -- where the values needed for the subtitles are kept
+    (int) talk -- the talk's id
+
+    Returns its state, 'missing' (there's no talk with the id), 'unavailable'
+    (the talk has no video to download) or 'queued', and its values, a dict
+    with the keys 'title', 'page', 'published', 'video' & 'size' for
+    Catalog.record().
+
+    """
+    page = CATALOG_URL.format(talk)
+    try:
+        values = read_page(page)
+    except urllib2.HTTPError:
+        if sys.exc_info()[1].code == 404:
+            return 'missing', {}
+        raise
+    except ScrapeError:
+        return 'missing', {}
+    if values['id'] != talk:
+        return 'missing', {}
+    video = values['urls'].get('high')
+    if not video:
+        return 'unavailable', {}
+    size = HTTP.head(video).getheader('Content-Length')
+    if not size:
+        raise IOError('Unknown size of the video {0}'.format(video))
+    cache.put({'id': talk, 'page': page, 'intro': values['intro'],
+               'urls': values['urls']})
+    return 'queued', {'title': values['title'], 'page': page, 'video': video,
+                      'size': int(size), 'published': values['published']}
+
+
+def read_feed(stream):
+    """Read the RSS feed while it's downloaded, yielding a FeedEntry by item.
+
+    The feed is parsed only as far as its entries are asked for, and every
+    item is dropped once read, so only one is kept in memory at a time.
+    Raises an ElementTree.ParseError if the feed is malformed.
+
+    """
+    channel = None
+    for event, elem in ElementTree.iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'channel':
+                channel = elem
+        elif elem.tag == 'item':
+            entry = FeedEntry(elem)
+            if channel is not None:
+                channel.clear()
+            yield entry
+
+
+def missing_subs(talk_id, v_name, cache, library, langs):
+    """The subtitles of a talk not downloaded yet, a list of (lang, name),
+    except the languages that TED hasn't for the talk (see TalkCache)."""
+    talk = cache.get(talk_id) or {}
+    return [(lang, s_name) for lang, s_name in
+            ((lang, "{0}.{1}.srt".format(v_name[:-4], lang)) for lang in langs)
+            if s_name not in library and
+            lang not in talk.get('unavailable', ())]
+
+
+def check_subs(ttalk, v_name, cache, library, langs):
     """Check if the subtitles for the talk are downloaded, if not try to get
-    them. Checks it for english and spanish languages."""
-    # Get the names for the subtitles (for english and spanish languages) only
-    # if they not are already downloaded
-    subs = (s_name for s_name in
-            ("{0}.{1}.srt".format(v_name[:-4], lang) for lang in ('eng',
-                                                                  'spa'))
-            if s_name not in glob.glob('*.srt'))
+    them. Checks it for the languages given, all of them at the same time.
+
+    The languages that TED reports as not available are recorded in the
+    cache, so they aren't asked for again until the talk's entry expires.
+
+    Returns the log and the result of every subtitle asked for, a dict by
+    its name ('downloaded', 'unavailable', 'busy' or 'error', see get_sub()).
+
+    """
+    with METRICS.talk(v_name):
+        return fetch_subs(ttalk, v_name, cache, library, langs)
+
+
+def fetch_subs(ttalk, v_name, cache, library, langs):
+    """Get the subtitles of a talk not downloaded yet (see check_subs())."""
+    # Get the names for the subtitles only if they not are already downloaded
+    subs = missing_subs(ttalk.id, v_name, cache, library, langs)
     s_log = ''
-    for sub in subs:
-        # Reads the talk web page, to search the talk's intro duration
-        if FOUND:
-            tt_webpage = Popen(['wget', '-q', '-O', '-',
-                                ttalk.feedburner_origlink],
-                               stdout=PIPE).stdout.read()
-        else:
-            tt_webpage = urllib2.urlopen(ttalk.feedburner_origlink).read()
-        regex = re.compile('"introDuration":(\d+\.?\d+),')
-        tt_intro = (float(regex.findall(tt_webpage)[0]) + 1) * 1000
-        subtitle, get_log = get_sub(ttalk.id.split(':')[-1], tt_intro, sub)
-        s_log += get_log
-        if subtitle:
-            with open(sub, 'w') as srt_file:
-                srt_file.write(subtitle)
+    if not subs:
+        return s_log, {}
+    talk = talk_values(cache, ttalk.id, ttalk.link)
+    results = [('error', '')] * len(subs)
+
+    def fetch(idx, lang, sub):
+        """Get a subtitle, storing its result in its place of the results."""
+        with METRICS.talk(v_name):
+            results[idx] = get_sub(talk['id'], talk['intro'], lang, sub)
+
+    workers = [threading.Thread(target=fetch, args=(idx, lang, sub))
+               for idx, (lang, sub) in enumerate(subs)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    unavailable = []
+    for (lang, sub), (result, message) in zip(subs, results):
+        if message:
+            s_log += '{0}{1}'.format(message, os.linesep)
+        if result == 'downloaded':
+            library.add(sub, talk['id'], lang)
+            METRICS.count('subtitles downloaded')
             s_log += "{0}{1} downloaded.{0}".format(os.linesep, sub)
-    return s_log
+        elif result == 'unavailable':
+            unavailable.append(lang)
+    if unavailable:
+        cache.mark_unavailable(talk['id'], unavailable)
+    return s_log, dict((sub, result) for (_, sub), (result, _) in
+                       zip(subs, results))
 
 
-def get_video(ttk, vid_url, vid_name):
-    """Gets the TED Talk video."""
-    if FOUND:
-        Popen(['wget', '-q', '-O', vid_name, vid_url],
-              stdout=PIPE).stdout.read()
-    else:
-        urllib.urlretrieve(vid_url, vid_name)
-    v_log = u'{0} ({1})\n'.format(ttk.subtitle, ttk.itunes_duration)
-    v_log += u'{0}\n\n'.format('=' * (len(ttk.subtitle) + 11))
-    v_log += u'{0}\n\n'.format(ttk.feedburner_origlink)
-    v_log += u'{0}\n\n'.format(fill(ttk.content[0].value, 80))
+def failed_subs(ttalk, results):
+    """The errors of the subtitles of a talk not downloaded (see
+    check_subs()), to add them to the log's, a list."""
+    failed = sorted(sub for sub, result in results.items() if
+                    result == 'error')
+    if not failed:
+        return []
+    return [u'{0} (subs): {1} not downloaded'.format(
+        ttalk.title, ', '.join(failed)).encode('utf8')]
+
+
+def fetch_range(url, part_name, checksum, priority=PRIORITY_VIDEO):
+    """Download a url to a partial file, resuming it from its current size.
+
+    Asks the server only for the missing bytes with a HTTP Range request, if
+    the server ignores it then the download starts again from the beginning.
+    The bandwidth is shared with the other transfers by the LIMITER, and the
+    bytes are hashed by the checksum as they are written.
+
+    """
+    offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+    with HTTP.open(url, headers) as response:
+        # Requested Range Not Satisfiable, nothing left to download
+        if response.status == 416:
+            response.read()
+            return
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        if not offset or response.status != 206:
+            offset = 0
+            checksum.truncate(0)
+        with open(part_name, 'ab' if offset else 'wb') as part_file:
+            chunk = response.read(CHUNK_SIZE)
+            while chunk:
+                part_file.write(chunk)
+                checksum.update(offset, chunk)
+                offset += len(chunk)
+                LIMITER.consume(len(chunk), priority)
+                chunk = response.read(CHUNK_SIZE)
+
+
+def fetch_segments(url, part_name, vid_size, segments, checksum,
+                   priority=PRIORITY_VIDEO):
+    """Download a url to a partial file by several byte ranges at a time.
+
+    The bytes still missing in the '.part' file are split in segments, each
+    one downloaded by its own connection & written in its place of the file,
+    that is preallocated to the whole size. Returns False, without touching
+    the file, if the server ignores the Range requests or reports another
+    size than the expected one.
+
+    If any segment fails, the file is cut to the bytes downloaded one after
+    another from its beginning, so the next try resumes it from there, and an
+    IOError is raised with the reasons. While the segments are downloading, a
+    '.seg' file holds that safe size in case the process dies (see
+    recover_segments()).
+
+    The segments start at the beginning of the checksum's blocks, so every
+    block is hashed one byte after another as it's downloaded.
+
+    """
+    offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    if offset >= vid_size:
+        return True
+    step = -(-(vid_size - offset) // segments)
+    step = max(HASH_BLOCK, -(-step // HASH_BLOCK) * HASH_BLOCK)
+    ranges = [(start, min(start + step, vid_size) - 1) for start in
+              range(offset, vid_size, step)]
+
+    def request(start, end):
+        """Ask for the bytes between start and end."""
+        return HTTP.open(url, {'Range': 'bytes={0}-{1}'.format(start, end)})
+
+    # Asking for the first byte tells if the server supports the ranges
+    with request(offset, offset) as probe:
+        probe.read()
+        content_range = probe.getheader('Content-Range') or ''
+        if (probe.status != 206 or
+                content_range.split('/')[-1] != str(vid_size)):
+            return False
+
+    with open('{0}.seg'.format(part_name), 'wb') as seg_file:
+        pickle.dump(offset, seg_file)
+    with open(part_name, 'ab') as part_file:
+        part_file.truncate(vid_size)
+    done = [0] * len(ranges)
+    failures = [None] * len(ranges)
+
+    def fetch(idx):
+        """Download a segment to its place in the partial file, storing why
+        it failed in its place of the failures."""
+        start, end = ranges[idx]
+        try:
+            with request(start, end) as response:
+                if response.status != 206:
+                    failures[idx] = 'HTTP {0} {1}'.format(response.status,
+                                                          response.reason)
+                    return
+                with open(part_name, 'r+b') as part_file:
+                    part_file.seek(start)
+                    chunk = response.read(min(CHUNK_SIZE, end - start + 1))
+                    while chunk:
+                        part_file.write(chunk)
+                        checksum.update(start + done[idx], chunk)
+                        done[idx] += len(chunk)
+                        LIMITER.consume(len(chunk), priority)
+                        chunk = response.read(min(CHUNK_SIZE,
+                                                  end - start + 1 -
+                                                  done[idx]))
+            if done[idx] != end - start + 1:
+                failures[idx] = 'closed at {0} of {1} bytes'.format(
+                    done[idx], end - start + 1)
+        except (IOError, socket.error, httplib.HTTPException):
+            failures[idx] = str(sys.exc_info()[1]) or 'connection lost'
+
+    workers = [threading.Thread(target=fetch, args=(idx,))
+               for idx in range(len(ranges))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Keep only the bytes downloaded without holes from the beginning
+    safe_size = offset
+    for idx, (start, end) in enumerate(ranges):
+        safe_size += done[idx]
+        if done[idx] != end - start + 1:
+            with open(part_name, 'r+b') as part_file:
+                part_file.truncate(safe_size)
+            checksum.truncate(safe_size)
+            break
+    os.remove('{0}.seg'.format(part_name))
+    failed = ['segment {0}: {1}'.format(idx + 1, failure) for idx, failure
+              in enumerate(failures) if failure]
+    if failed:
+        raise IOError('Incomplete download, {0}'.format('; '.join(failed)))
+    return True
+
+
+def recover_segments(part_name):
+    """Cut a partial file left by a segmented download that never ended.
+
+    The holes of the unfinished segments can't be told apart from the
+    downloaded bytes, so the file is cut to the size it had when the
+    segmented download started.
+
+    """
+    seg_name = '{0}.seg'.format(part_name)
+    if os.path.exists(seg_name):
+        try:
+            with open(seg_name, 'rb') as seg_file:
+                safe_size = pickle.load(seg_file)
+        except (EOFError, IOError, pickle.PickleError):
+            safe_size = 0
+        if os.path.exists(part_name):
+            with open(part_name, 'r+b') as part_file:
+                part_file.truncate(safe_size)
+        os.remove(seg_name)
+
+
+def download(vid_url, vid_name, vid_size, segments=1,
+             priority=PRIORITY_VIDEO):
+    """Download a video to a '.part' file & rename it only when complete.
+
+    An interrupted download leaves the '.part' file, the next call resumes it
+    from where it was left. With more than one segment, the missing bytes are
+    downloaded by several connections at a time, or by only one if the server
+    doesn't support it. Raises an IOError if the file is not complete.
+
+    The video is hashed while it's downloaded (see Checksum), a resumed
+    download restarts from its last block hashed. Returns the checksum.
+
+    """
+    part_name = '{0}.part'.format(vid_name)
+    recover_segments(part_name)
+    checksum = Checksum(vid_size, '{0}.hash'.format(part_name))
+    part_size = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    if part_size and not os.path.exists(checksum.filename):
+        # Left by a previous version, without the hashes of its blocks
+        checksum.read(part_name, min(part_size, vid_size))
+    checksum.truncate(part_size)
+    if part_size > checksum.safe_size():
+        with open(part_name, 'r+b') as part_file:
+            part_file.truncate(checksum.safe_size())
+    segmented = segments > 1 and fetch_segments(vid_url, part_name, vid_size,
+                                                segments, checksum, priority)
+    if not segmented:
+        fetch_range(vid_url, part_name, checksum, priority)
+    part_size = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    if part_size > vid_size:
+        # Something went wrong with the resumed bytes, start again next time
+        os.remove(part_name)
+        checksum.remove()
+    if part_size != vid_size or checksum.hexdigest() is None:
+        raise IOError('Incomplete download, {0} of {1} bytes'.
+                      format(part_size, vid_size))
+    os.rename(part_name, vid_name)
+    checksum.remove()
+    return checksum.hexdigest()
+
+
+def hash_file(name):
+    """Compute the checksum of a file (see Checksum), by big sequential reads.
+
+    Returns the name, its size (None if it can't be read) and its checksum.
+
+    """
+    try:
+        checksum = Checksum(os.path.getsize(name))
+        checksum.read(name)
+    except (IOError, OSError):
+        return name, None, None
+    return name, checksum.size, checksum.hexdigest()
+
+
+def verify(library, jobs=None):
+    """Check the files of the library against their sizes and checksums.
+
+    The files are read by several processes at a time, one by core unless
+    jobs says other thing. The videos indexed without checksum get the one
+    computed now. The corrupt, truncated and missing files are rejected
+    (dropped from the library and recorded to download them again by the
+    next run, see Library.unfinished()), the subtitles are removed and the
+    videos are left as (empty if corrupt) '.part' files of their variants.
+
+    Returns the lists of the corrupt, the truncated & the missing files.
+
+    """
+    files = dict((name, (size, digest)) for name, size, digest in
+                 library.files())
+    corrupt, truncated, missing = [], [], []
+    start, total = time.time(), 0
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for name, size, digest in pool.imap_unordered(hash_file,
+                                                      sorted(files)):
+            total += size or 0
+            if size is None:
+                missing.append(name)
+            elif size != files[name][0]:
+                truncated.append(name)
+            elif files[name][1] and digest != files[name][1]:
+                corrupt.append(name)
+            elif not files[name][1] and name.endswith('.mp4'):
+                library.set_checksum(name, digest)
+    finally:
+        pool.close()
+        pool.join()
+    METRICS.add('verify', time.time() - start, total)
+    for name in corrupt + truncated + missing:
+        variant = library.variant(name)
+        library.reject(name)
+        if not os.path.exists(name):
+            continue
+        if name.endswith('.srt'):
+            os.remove(name)
+        else:
+            os.rename(name, '{0}.part'.format(name))
+            if name in corrupt:
+                with open('{0}.part'.format(name), 'wb'):
+                    pass
+            if variant:
+                with open('{0}.part.variant'.format(name), 'w') as var_file:
+                    var_file.write(variant)
+    return corrupt, truncated, missing
+
+
+def get_video(ttk, vid_name, library, cache, segments=1,
+              priority=PRIORITY_VIDEO):
+    """Gets the TED Talk video and adds it to the library's index.
+
+    The variant downloaded is chosen by the quality policy (QUALITY). Returns
+    the video's log, '' if there's nothing to download (the video is already
+    in the library, e.g. downloaded by another host, and it's not upgraded)
+    or None if it's left for the next run (it doesn't fit in the run's
+    budget or in the quota).
+
+    """
+    stored = None
+    if vid_name in library:
+        stored = library.variant(vid_name)
+        if not QUALITY.better(stored):
+            return ''
+    choice = QUALITY.choose(ttk, vid_name, cache, stored)
+    if choice is None:
+        return '' if stored else None
+    quality, vid_url, vid_size = choice
+    if (vid_size != ttk.video_size and
+            library.reserve(vid_name, vid_size) is None):
+        return None
+    part_name = '{0}.part'.format(vid_name)
+    resumed = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    # The talk is indexed first, to resume its video if it's interrupted
+    # (see Library.unfinished())
+    library.add_talk(ttk.id, ttk.title, ttk.published_parsed, vid_name)
+    start = time.time()
+    with METRICS.talk(vid_name):
+        checksum = download(vid_url, vid_name, vid_size, segments, priority)
+    if os.path.exists('{0}.variant'.format(part_name)):
+        os.remove('{0}.variant'.format(part_name))
+    seconds = time.time() - start
+    METRICS.add('videos', seconds, vid_size - resumed)
+    METRICS.talk_values(vid_name, bytes=vid_size - resumed, seconds=seconds)
+    METRICS.count('videos downloaded')
+    if stored:
+        METRICS.count('videos upgraded')
+    library.add(vid_name, ttk.id, checksum=checksum, variant=quality)
+    v_log = u'{0} ({1})\n'.format(ttk.title, ttk.duration)
+    v_log += u'{0}\n\n'.format('=' * (len(ttk.title) + 11))
+    v_log += u'{0}\n\n'.format(ttk.link)
+    v_log += u'{0}\n\n'.format(fill(ttk.summary, 80))
     v_log += u'file://{0}\n'.format(os.path.join(os.getcwd(), vid_name))
-    vid_size = best_unit_size(int(ttk.media_content[0]['filesize']))
-    v_log += u'{0:.2f} {1}\n\n'.format(vid_size['s'], vid_size['u'])
+    vid_size = best_unit_size(vid_size)
+    variant = '' if quality == ttk.quality else ', {0}'.format(quality)
+    v_log += u'{0:.2f} {1}{2}\n\n'.format(vid_size['s'], vid_size['u'],
+                                          variant)
     return v_log.encode('utf8')
 
 
+def get_catalog_video(ttk, vid_name, library, cache, segments=1):
+    """Gets the video of a talk out of the feed (a CatalogEntry without its
+    video), the one of its web page, see get_video().
+
+    Raises an IOError if the talk, or its video, is no longer there.
+
+    """
+    state, values = scrape_talk(cache, ttk.id)
+    if state != 'queued':
+        raise IOError('The talk is {0} in its web page {1}'.format(
+            state, ttk.link))
+    ttk.title = ttk.title or values['title']
+    ttk.video_url, ttk.video_size = values['video'], values['size']
+    # A video interrupted without its variant may be the feed's one (see
+    # QualityPolicy.choose()), so it starts over
+    part_name = '{0}.part'.format(vid_name)
+    if not os.path.exists('{0}.variant'.format(part_name)):
+        for name in (part_name, '{0}.hash'.format(part_name)):
+            if os.path.exists(name):
+                os.remove(name)
+    if library.reserve(vid_name, ttk.video_size) is None:
+        return None
+    return get_video(ttk, vid_name, library, cache, segments,
+                     PRIORITY_BACKFILL)
+
+
+def queue_talk(scheduler, idx, ttalk, last, library, pending, cache, langs,
+               segments=1, leases=None):
+    """Queue the jobs needed for a talk of the feed.
+
+    The video is queued if it's newer than the last one downloaded or if it
+    was interrupted in a previous run or rejected by verify() (or if it's
+    stored in a quality to upgrade), and there's room for it in the
+    library's quota, and the subtitles if the video is (or will be) in the
+    library and some of them are missing.
+
+    If the folder is shared with other hosts (leases), every job runs only
+    if it claims its lease, see leased_job().
+
+    Returns False if the talk needs nothing.
+
+    """
+    # The talk may be stored by a catalog sync, with the name of its page's
+    # video
+    vid_name = (library.video(ttalk.id) or
+                ttalk.video_url.split('/')[-1].split('?')[0])
+    published = calendar.timegm(ttalk.published_parsed)
+    new = ttalk.published_parsed > last
+    resume = (os.path.exists('{0}.part'.format(vid_name)) or
+              library.rejected(vid_name))
+    upgrade = (QUALITY.upgrade and vid_name in library and
+               QUALITY.better(library.variant(vid_name)))
+    # If the video is new or was interrupted in a previous run, get it!
+    if ((((new or resume) and vid_name not in library) or upgrade) and
+            library.reserve(vid_name, ttalk.video_size) is not None):
+        priority = (PRIORITY_VIDEO if new and not upgrade else
+                    PRIORITY_BACKFILL)
+        job = (get_video, ttalk, vid_name, library, cache, segments,
+               priority)
+        if leases is not None:
+            job = (leased_job, leases, library, vid_name, [vid_name]) + job
+        scheduler.submit('video', idx, (priority, -published), *job)
+        pending.add(vid_name)
+    subs = queue_subs(scheduler, idx, ttalk, vid_name, library, pending,
+                      cache, langs, leases)
+    return bool(new or resume or upgrade or subs)
+
+
+def queue_subs(scheduler, idx, ttalk, vid_name, library, pending, cache,
+               langs, leases=None):
+    """Queue the job of the subtitles of a talk (a FeedEntry or a
+    CatalogEntry), if its video is (or will be) in the library and some of
+    them are missing.
+
+    Returns the subtitles queued, a list of (lang, name).
+
+    """
+    # If video is already downloaded, check if subs exists, if not, get it!
+    subs = ((vid_name in library or vid_name in pending) and
+            missing_subs(ttalk.id, vid_name, cache, library, langs))
+    if subs:
+        published = (calendar.timegm(ttalk.published_parsed) if
+                     ttalk.published_parsed else 0)
+        job = (check_subs, ttalk, vid_name, cache, library, langs)
+        if leases is not None:
+            job = (leased_job, leases, library,
+                   '{0}.subs'.format(vid_name[:-4]),
+                   [s_name for _, s_name in subs]) + job
+        scheduler.submit('subs', idx, (PRIORITY_URGENT, -published), *job)
+    return subs or []
+
+
+def queue_unfinished(scheduler, idx, ttalk, vid_name, library, pending,
+                     cache, langs, segments=1, leases=None):
+    """Queue the jobs of a talk of the library with work left that isn't in
+    the feed (see Library.unfinished()), a CatalogEntry without its video.
+
+    Its video is queued if it was interrupted or rejected by verify(), to
+    download it from the talk's web page (see get_catalog_video()), and its
+    subtitles if some of them are missing.
+
+    """
+    if vid_name not in library:
+        published = (calendar.timegm(ttalk.published_parsed) if
+                     ttalk.published_parsed else 0)
+        job = (get_catalog_video, ttalk, vid_name, library, cache, segments)
+        if leases is not None:
+            job = (leased_job, leases, library, vid_name, [vid_name]) + job
+        scheduler.submit('video', idx, (PRIORITY_BACKFILL, -published),
+                         *job)
+        pending.add(vid_name)
+    queue_subs(scheduler, idx, ttalk, vid_name, library, pending, cache,
+               langs, leases)
+
+
+def leased_job(leases, library, lease, names, func, *args):
+    """Run a job holding its lease, the folder is shared with other hosts.
+
+    (Leases) leases -- the leases of this process
+    (Library) library -- the library's index
+    (str) lease -- the name of the job's lease
+    (list) names -- the files that the job downloads
+    (callable) func -- the job itself, called as func(*args)
+
+    The files are read again from the index before the job runs, so it skips
+    the ones that the other hosts downloaded. Returns None, without running
+    the job, if another host holds the lease.
+
+    """
+    if not leases.claim(lease):
+        library.unreserve(names)
+        return None
+    try:
+        library.refresh(names)
+        return func(*args)
+    finally:
+        leases.release(lease)
+
+
+class Downloader():
+    """
+
+    Download the new talks of the feed, keeping its state between polls.
+
+    The state of the last run (the date of the last talk downloaded and the
+    feed's validators), the library's index and the cache of the talks are
+    loaded once and kept in memory, so a long running process (see watch())
+    only asks for the feed, and only reads it if it has changed.
+
+    In distributed mode the folder is shared by several hosts, and every
+    video and talk's subtitles are downloaded by the host that claims their
+    lease (see Leases).
+
+    """
+
+    def __init__(self, args):
+        """Load the state of the last run.
+
+        (argparse.Namespace) args -- the command line arguments
+
+        """
+        self.args = args
+        self.langs = [lang.strip() for lang in args.languages.split(',')
+                      if lang.strip()]
+        self.state = load_state()
+        self.library = None
+        self.cache = None
+        self.leases = Leases(args.lease) if args.distributed else None
+        LIMITER.configure(parse_size(args.rate), parse_schedule(args.schedule))
+        QUALITY.configure(args.quality, parse_size(args.max_size),
+                          parse_size(args.budget), args.upgrade)
+
+    def __open(self):
+        """Open the library's index and the talks' cache, only the first
+        time that they are needed."""
+        if self.library is None:
+            self.library = Library(quota=parse_size(self.args.quota),
+                                   policy=self.args.evict,
+                                   shared=self.args.distributed)
+            if self.args.rebuild_index:
+                self.library.rebuild()
+            self.cache = TalkCache()
+        return self.library, self.cache
+
+    def poll(self, log):
+        """Read the feed, only if it has changed, and download its new talks.
+
+        The talks downloaded and the errors are added to the log. Returns
+        'not modified', 'failed' (if the feed couldn't be read at all) or
+        'done'.
+
+        """
+        args, state = self.args, self.state
+        QUALITY.new_run()
+
+        # Another quality policy may choose other variants of the same talks,
+        # so the feed is read again even if it hasn't changed
+        if state['quality'] != QUALITY.settings():
+            state['etag'] = state['modified'] = None
+            state['expires'] = 0
+            state['quality'] = QUALITY.settings()
+
+        # The feed read the last time is still fresh, as its server said, so
+        # there is no need to ask for it (nor to import what reads it)
+        if time.time() < state['expires']:
+            METRICS.count('feed fresh')
+            return 'not modified'
+
+        headers = {}
+        if state['etag']:
+            headers['If-None-Match'] = state['etag']
+        if state['modified']:
+            headers['If-Modified-Since'] = state['modified']
+        entries, others, scheduler = [], [], None
+        error, feed_status = None, None
+        start = time.time()
+        try:
+            with HTTP.open(FEED_URL, headers) as response:
+                METRICS.add('feed fetch', time.time() - start)
+                feed_status = response.status
+                feed_etag = response.getheader('ETag')
+                feed_modified = response.getheader('Last-Modified')
+                feed_expires = fresh_until(response)
+                if feed_status >= 400:
+                    raise urllib2.HTTPError(FEED_URL, feed_status,
+                                            response.reason, response.msg,
+                                            None)
+                if feed_status != 304:
+                    # The videos and the subtitles are downloaded at the same
+                    # time by the scheduler's workers while the feed is read,
+                    # the subtitles first, then the newest videos and the
+                    # interrupted older ones at last
+                    library, cache = self.__open()
+                    pending = set()
+                    scheduler = Scheduler({'video': args.video_jobs,
+                                           'subs': args.sub_jobs})
+                    stream = ResponseStream(response)
+                    # The talks of the library with work left (videos
+                    # interrupted or rejected by -c, subtitles missing, e.g.
+                    # TED was busy) may be older than the last one downloaded
+                    waiting = dict((talk, (title, published, video)) for
+                                   talk, title, published, video in
+                                   library.unfinished(self.langs) if
+                                   video not in library or
+                                   missing_subs(talk, video, cache, library,
+                                                self.langs))
+                    start = time.time()
+                    try:
+                        for idx, entry in enumerate(read_feed(stream)):
+                            entries.append(entry)
+                            waiting.pop(entry.id, None)
+                            published = calendar.timegm(
+                                entry.published_parsed)
+                            further = [talk for talk, (_, date, _) in
+                                       waiting.items() if date and
+                                       date <= published]
+                            if (not queue_talk(scheduler, idx, entry,
+                                               state['last'], library,
+                                               pending, cache, self.langs,
+                                               args.segments, self.leases)
+                                    and not further):
+                                # The feed is newest first, past the last
+                                # video downloaded, with nothing to get and
+                                # no talk with work left further on
+                                break
+                    finally:
+                        METRICS.add('feed parse', time.time() - start,
+                                    stream.size)
+                    # The talks with work left not found in the feed (e.g.
+                    # synced from the catalog) are read from their web pages
+                    for talk, (title, published, video) in sorted(
+                            waiting.items()):
+                        entry = CatalogEntry(talk, title,
+                                             CATALOG_URL.format(talk),
+                                             published, None, None)
+                        queue_unfinished(scheduler,
+                                         len(entries) + len(others), entry,
+                                         video, library, pending, cache,
+                                         self.langs, args.segments,
+                                         self.leases)
+                        others.append(entry)
+        except (IOError, httplib.HTTPException, ElementTree.ParseError,
+                ValueError):
+            error = sys.exc_info()[1]
+        METRICS.count('feed entries read', len(entries))
+
+        # If the feed has not changed, there is nothing new to download
+        if not error and feed_status == 304:
+            METRICS.count('feed not modified')
+            state['expires'] = feed_expires
+            save_state(state)
+            return 'not modified'
+
+        results = {}
+        if scheduler:
+            results = scheduler.join()
+            self.cache.save()
+        lost = []
+        if self.leases is not None:
+            lost, self.leases.lost = self.leases.lost, []
+
+        # If the feed is erroneous or occurs a http or network error, log it
+        if error and not entries:
+            log.list('An error occurred', str(error))
+            return 'failed'
+
+        # Collect the results in the feed order (then the talks out of the
+        # feed), whatever the order they finished
+        vids_log, subs_log, errors, video_dates = [], [], [], []
+        left, left_dates = [], []
+        for idx, entry in enumerate(entries + others):
+            # The jobs left for the next run (their leases are held by other
+            # hosts or they are over the budget) returned None
+            if (True, None) in (results.get(('video', idx)),
+                                results.get(('subs', idx))):
+                left.append(entry.title.encode('utf8'))
+            if ('video', idx) in results:
+                success, v_log = results[('video', idx)]
+                # The talks out of the feed don't move the last date
+                dates = ((left_dates, video_dates) if idx < len(entries) else
+                         ([], []))
+                if not success:
+                    errors.append(u'{0}: {1}'.format(entry.title,
+                                                     v_log).encode('utf8'))
+                    dates[0].append(entry.published_parsed)
+                elif v_log is None:
+                    dates[0].append(entry.published_parsed)
+                else:
+                    vids_log.append(v_log)
+                    dates[1].append(entry.published_parsed)
+            if ('subs', idx) in results:
+                success, s_log = results[('subs', idx)]
+                if not success:
+                    errors.append(u'{0} (subs): {1}'.
+                                  format(entry.title, s_log).encode('utf8'))
+                elif s_log is not None:
+                    s_log, subs = s_log
+                    subs_log.append(s_log)
+                    errors.extend(failed_subs(entry, subs))
+                    # The subtitles that TED was too busy to give are asked
+                    # for again by the next run (see Library.unfinished())
+                    if 'busy' in subs.values():
+                        left.append(entry.title.encode('utf8'))
+        log.list('Talks downloaded', ''.join(vids_log))
+        log.list('Subs downloaded', [''.join(subs_log)])
+        log.list('Left for the next run', left)
+        if error:
+            errors.append('Feed: {0}'.format(error))
+        errors.extend('{0}: lease taken over by another host'.format(name)
+                      for name in lost)
+        errors.extend("{0}: doesn't fit in the quota".format(name) for name
+                      in self.library.skipped)
+        log.list('Evicted (quota)', self.library.evicted)
+        log.list('Errors', errors)
+        self.library.evicted, self.library.skipped = [], []
+
+        # Set the last download video date (older than the videos that failed
+        # or were left for the next run, so it tries them again) and, if all
+        # went right, the feed's validators to ask for it only if it changes
+        # (not while some talks are left, e.g. the other hosts may die before
+        # they finish them)
+        if left_dates:
+            video_dates = [date for date in video_dates if
+                           date < min(left_dates)]
+        if video_dates:
+            state['last'] = max([state['last']] + video_dates)
+        if not errors and not left:
+            state['etag'], state['modified'] = feed_etag, feed_modified
+            state['expires'] = feed_expires
+        save_state(state)
+        return 'done'
+
+    def sync(self, log):
+        """Download all the talks of the catalog, not only the feed's.
+
+        The talks' ids are read a window at a time (see Catalog), then the
+        talks found are downloaded, and the queue is updated after every
+        step, so a sync interrupted goes on from where it was left by the
+        next one. The talks downloaded and the errors are added to the log.
+        Returns 'done'.
+
+        """
+        args = self.args
+        library, cache = self.__open()
+        catalog = Catalog()
+        catalog.restart()
+        QUALITY.new_run()
+        vids_log, subs_log, errors, left = [], [], [], []
+        try:
+            while True:
+                # Read the web pages of the next ids of the catalog
+                ids = catalog.window()
+                if ids:
+                    scheduler = Scheduler({'subs': args.sub_jobs})
+                    for talk in ids:
+                        scheduler.submit('subs', talk, (PRIORITY_URGENT,),
+                                         scrape_talk, cache, talk)
+                    results = dict((talk, result) for (_, talk), result in
+                                   scheduler.join().items())
+                    errors.extend('Talk {0}: {1}'.format(talk, error) for
+                                  talk, error in catalog.record(ids, results))
+                    cache.save()
+
+                # Download the talks found, the oldest first
+                entries = catalog.work()
+                if not ids and not entries:
+                    break
+                scheduler = Scheduler({'video': args.video_jobs,
+                                       'subs': args.sub_jobs})
+                names, pending = {}, set()
+                for entry in entries:
+                    vid_name = (library.video(entry.id) or
+                                entry.video_url.split('/')[-1])
+                    names[entry.id] = vid_name
+                    if (vid_name not in library and
+                            library.reserve(vid_name, entry.video_size)
+                            is not None):
+                        scheduler.submit('video', entry.id,
+                                         (PRIORITY_BACKFILL, entry.id),
+                                         get_video, entry, vid_name,
+                                         library, cache, args.segments,
+                                         PRIORITY_BACKFILL)
+                        pending.add(vid_name)
+                    if ((vid_name in library or vid_name in pending) and
+                            missing_subs(entry.id, vid_name, cache, library,
+                                         self.langs)):
+                        scheduler.submit('subs', entry.id,
+                                         (PRIORITY_URGENT, entry.id),
+                                         check_subs, entry, vid_name, cache,
+                                         library, self.langs)
+                results = scheduler.join()
+                cache.save()
+                states = {}
+                for entry in entries:
+                    video = results.get(('video', entry.id), (True, ''))
+                    subs = results.get(('subs', entry.id), (True, ('', {})))
+                    if video[0] and video[1]:
+                        vids_log.append(video[1])
+                    failed = []
+                    if subs[0]:
+                        subs_log.append(subs[1][0])
+                        failed = failed_subs(entry, subs[1][1])
+                        errors.extend(failed)
+                    for success, message in (video, subs):
+                        if not success:
+                            errors.append(u'{0}: {1}'.format(
+                                entry.title, message).encode('utf8'))
+                    if video == (True, None):
+                        # Over the run's budget, still queued
+                        left.append(entry.title.encode('utf8'))
+                    elif names[entry.id] in library.skipped:
+                        states[entry.id] = 'skipped'
+                    elif (video[0] and subs[0] and not failed and
+                          'busy' not in subs[1][1].values()):
+                        states[entry.id] = 'done'
+                    else:
+                        states[entry.id] = 'queued'
+                catalog.finish(states)
+                if left:
+                    break
+        finally:
+            counts = catalog.counts()
+            catalog.close()
+        log.list('Talks downloaded', ''.join(vids_log))
+        log.list('Subs downloaded', [''.join(subs_log)])
+        errors.extend("{0}: doesn't fit in the quota".format(name) for name
+                      in library.skipped)
+        log.list('Left for the next run', left)
+        log.list('Evicted (quota)', library.evicted)
+        log.list('Errors', errors)
+        library.evicted, library.skipped = [], []
+        log.list('Catalog', '{0} talks, {1} downloaded, {2} without video, '
+                 '{3} failed, {4} skipped'.format(
+                     sum(counts.get(state, 0) for state in
+                         ('pending', 'queued', 'done', 'unavailable',
+                          'failed', 'skipped')), counts.get('done', 0),
+                     counts.get('unavailable', 0), counts.get('failed', 0),
+                     counts.get('skipped', 0)))
+        return 'done'
+
+    def publish_hours(self):
+        """The talks of the library published by hour of the week."""
+        return self.__open()[0].publish_hours()
+
+    def close(self, log):
+        """Log the size of the library and the requests in flight allowed by
+        every host, and close the library."""
+        log.list('Concurrency', ['{0}: {1} requests at a time'.format(
+            host, limit) for host, limit in sorted(HTTP.limits().items())])
+        if self.leases is not None:
+            self.leases.close()
+        if self.library is not None:
+            lib_size = best_unit_size(self.library.size())
+            log.list('Library', '{0} files, {1:.2f} {2}'.
+                     format(len(self.library), lib_size['s'], lib_size['u']))
+            self.library.close()
+            self.library = None
+
+
+def next_publish(hours, moment, usual=2):
+    """The seconds from a moment to the next usual hour of publication.
+
+    (dict) hours -- the talks published by hour of the week, see
+                    Library.publish_hours()
+    (float) moment -- the time, in seconds since the epoch
+    (int) usual -- the talks published in an hour to be usual
+
+    It's 0 if the moment is in a usual hour, or None if there isn't any.
+
+    """
+    hour_start = moment - moment % 3600
+    for ahead in range(7 * 24):
+        then = time.gmtime(hour_start + ahead * 3600)
+        if hours.get((then.tm_wday, then.tm_hour), 0) >= usual:
+            return max(0, hour_start + ahead * 3600 - moment)
+    return None
+
+
+def watch(downloader, log, poll_min, poll_max, summary, outbox=None):
+    """Poll the feed until the process is stopped, on an adaptive interval.
+
+    (Downloader) downloader -- the state kept between polls
+    (Logger) log -- the log, sent by mail as a summary
+    (int) poll_min -- the seconds between polls when the feed changes
+    (int) poll_max -- the seconds between polls at most
+    (int) summary -- the seconds between the summaries sent by mail
+    (Outbox) outbox -- the mails to send (None, no mail)
+
+    The interval doubles every time that the feed hasn't changed, up to
+    poll_max, and it's poll_min again when it changes and during the hours of
+    the week when TED usually publishes (learned from the talks of the
+    library). The new talks are downloaded as soon as they are found. A
+    summary is sent only if something happened since the last one, in the
+    background, while the polls go on. The metrics file has the talks of the
+    last poll, the previous ones only add to their totals.
+
+    """
+    metrics_name = '{0}.metrics.json'.format(os.path.splitext(log.filename)[0])
+    interval, news = poll_min, False
+    next_summary = time.time() + summary
+    while True:
+        status = downloader.poll(log)
+        if status == 'done':
+            interval, news = poll_min, True
+        else:
+            interval = min(interval * 2, poll_max)
+            news = news or status == 'failed'
+        METRICS.write(metrics_name)
+        METRICS.roll_up()
+        wait = next_publish(downloader.publish_hours(), time.time())
+        if wait is not None:
+            interval = max(poll_min, min(interval, wait))
+        if time.time() >= next_summary:
+            if news and outbox is not None:
+                mail_errors, outbox.errors = outbox.errors, []
+                log.list('Mail errors', mail_errors)
+                log.block('Metrics', METRICS.summary())
+                log.time('Summary time')
+                log.send('Download TED Talks', outbox)
+            log.clear()
+            next_summary, news = time.time() + summary, False
+        time.sleep(interval)
+
+
+def send_log(log, outbox, subject=None):
+    """Queue the log of the run to send it by mail and wait a while for the
+    mails queued to be sent, before the script ends.
+
+    (Logger) log -- the log of the run
+    (Outbox) outbox -- the mails to send (None, no mail)
+    (str) subject -- the mail's subject (None, only the mails queued before
+                     are sent)
+
+    The mails not sent (the server is slow or down, or it's not the time of
+    the digest) are left for the next run, the errors only go to the log
+    file.
+
+    """
+    if outbox is None:
+        return
+    mail_errors, outbox.errors = outbox.errors, []
+    log.list('Mail errors', mail_errors)
+    if subject:
+        log.send(subject, outbox)
+    outbox.close()
+    log.list('Mail errors', outbox.errors)
+
+
 def main():
     """main section"""
 
@@ -433,8 +3105,19 @@ def main():
     args = arguments().parse_args()
     ttalk_vid_dir = args.path
 
+    os.chdir(os.path.normpath(ttalk_vid_dir))
+
     # initalize the log
-    log = Logger()
+    log = Logger(args.log_format, parse_size(args.log_size),
+                 args.log_age * 86400)
+    metrics_name = '{0}.metrics.json'.format(os.path.splitext(log.filename)[0])
+
+    # The mails of the previous runs not sent yet go out while this one runs
+    outbox = None
+    if not WIN_OS and not args.no_mail:
+        outbox = Outbox(digest=args.digest * 3600,
+                        mail_server=args.mail_server)
+        outbox.start()
 
     # log the header
     url = 'http://joedicastro.com'
@@ -444,62 +3127,80 @@ def main():
     # log the start time
     log.time('Start Time')
 
-    os.chdir(os.path.normpath(ttalk_vid_dir))
-
-    # Get a list of the current TED Talks downloaded in the dir
-    videos = glob.glob('*.mp4')
+    # Verify the library and mark the wrong files to download them again, the
+    # feed has to be read again by the next run to find them
+    if args.verify:
+        library = Library()
+        corrupt, truncated, missing = verify(library)
+        library.close()
+        log.list('Corrupt files', corrupt)
+        log.list('Truncated files', truncated)
+        log.list('Missing files', missing)
+        log.list('Verified', '{0} files, {1} wrong'.format(
+            len(library) + len(corrupt + truncated + missing),
+            len(corrupt + truncated + missing)))
+        if corrupt or truncated or missing:
+            state = load_state()
+            state['etag'] = state['modified'] = None
+            state['expires'] = 0
+            save_state(state)
+        log.block('Metrics', METRICS.summary())
+        log.time('End time')
+        send_log(log, outbox, 'Verify TED Talks')
+        log.close()
+        return
+
+    # The state of the last run, kept in memory while watching the feed
+    downloader = Downloader(args)
+
+    # Download all the talks, a window of the catalog at a time
+    if args.catalog:
+        try:
+            downloader.sync(log)
+        finally:
+            downloader.close(log)
+            log.block('Metrics', METRICS.summary())
+            METRICS.write(metrics_name)
+            log.time('End time')
+        send_log(log, outbox, 'Sync TED Talks')
+        log.close()
+        return
+
+    if args.watch:
+        poll_min, poll_max = (float(minutes) * 60 for minutes in
+                              args.poll.split(','))
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            watch(downloader, log, poll_min, poll_max, args.summary * 3600,
+                  outbox)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            downloader.close(log)
+            log.block('Metrics', METRICS.summary())
+            METRICS.write(metrics_name)
+            log.time('End time')
+            send_log(log, outbox)
+            log.close()
+        return
+
+    status = downloader.poll(log)
+    downloader.close(log)
+    if status == 'not modified':
+        log.list('Feed not modified', 'Nothing new since the last run.')
+    log.block('Metrics', METRICS.summary())
+    METRICS.write(metrics_name)
+    log.time('End time')
 
-    # Get the last download Talk video date
-    try:
-        with open('.data.pkl', 'rb') as pkl_file:
-            last = pickle.load(pkl_file)
-    except (EOFError, IOError, pickle.PickleError):
-        last = time.localtime(time.time() - 86400)
-    video_dates = []
-
-    # The TED Talks HD RSS feed
-    ttalk_feed_url = 'http://feeds.feedburner.com/tedtalksHD'
-    ttalk_feed = feedparser.parse(ttalk_feed_url)
-
-    # If the feed is erroneous or occurs a http or network error, log and exit!
-    if ttalk_feed.bozo:
-        log.list('An error occurred', str(ttalk_feed.bozo_exception))
-        if not WIN_OS:
-            log.send('Download TED Talks')
+    # If logs any activity, sends the information mail, if the feed couldn't
+    # be read, exit with an error
+    send_log(log, outbox, 'Download TED Talks' if status != 'not modified'
+             else None)
+    log.close()
+    if status == 'failed':
         sys.exit(1)
 
-    # If correct, process the feed entries
-    vids_log, subs_log = '', ''
-    for ttalk_entrie in ttalk_feed.entries:
-        # Get The video url and name
-        tt_vid_url = ttalk_entrie.media_content[0]['url']
-        tt_vid_name = tt_vid_url.split('/')[-1].split('?')[0]
-        # If the video is new, download it!
-        if ttalk_entrie.published_parsed > last and tt_vid_name not in videos:
-            vids_log += get_video(ttalk_entrie, tt_vid_url, tt_vid_name)
-            videos.append(tt_vid_name)
-            video_dates.append(ttalk_entrie.published_parsed)
-        # If video is already downloaded, check if subs exists, if not, get it!
-        if tt_vid_name in videos:
-            subs_log += check_subs(ttalk_entrie, tt_vid_name)
-    log.list('Talks downloaded', vids_log)
-    log.list('Subs downloaded', [subs_log])
-
-    # Set the last download video date
-    if video_dates:
-        last = max(video_dates)
-        with open('.data.pkl', 'wb') as output:
-            pickle.dump(last, output)
-
-    log.time('End time')
-    # If logs any activity, sends the information mail
-    if not WIN_OS:
-        log.send('Download TED Talks')
-    log.write(False)
-
 
 if __name__ == "__main__":
-    WIN_OS = True if platform.system() == 'Windows' else False
-    if not WIN_OS:
-        FOUND = check_exec_posix('wget')
+    WIN_OS = True if os.name == 'nt' else False
     main()
@@ -0,0 +1,751 @@
+#!/usr/bin/env python2
+# -*- coding: utf8 -*-
+
+"""
+    tedcommon.py: The code shared by TEDTalks.py & TEDSubs.py
+"""
+
+#==============================================================================
+# The pool of HTTP connections, the talks' cache, the reading of a talk's
+# values from its web page and the download of its subtitles, the same for
+# both scripts. It's not a script itself, it has to be next to them.
+#==============================================================================
+
+#==============================================================================
+#    Copyright 2010 joe di castro <joe@joedicastro.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+__author__ = "joe di castro - joe@joedicastro.com"
+__license__ = "GNU General Public License version 3"
+
+import contextlib
+import itertools
+import os
+import pickle
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+
+class LazyModule():
+    """
+
+    A module imported the first time that one of its attributes is used.
+
+    Most runs of the scripts have nothing to do (the feed hasn't changed,
+    the talk is already downloaded), so the modules to read the web pages,
+    the feed or the subtitles are only imported by the runs that need them,
+    and the start up is much faster.
+
+    """
+
+    def __init__(self, name):
+        """Create the module, not imported yet.
+
+        (str) name -- the full name of the module, e.g. 'email.utils'
+
+        """
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            __import__(self.__name)
+            self.__module = sys.modules[self.__name]
+        return getattr(self.__module, attr)
+
+
+httplib = LazyModule('httplib')
+json = LazyModule('json')
+socket = LazyModule('socket')
+urllib = LazyModule('urllib')
+urllib2 = LazyModule('urllib2')
+urlparse = LazyModule('urlparse')
+
+# size of the blocks read from the network and written to the files
+CHUNK_SIZE = 64 * 1024
+# seconds that the values scraped from a talk's web page are valid
+CACHE_TTL = 7 * 86400
+# seconds to wait, at most, before the first retry of a request throttled (the
+# wait doubles with every retry), and requests in flight to a host at first
+# and at most (see Concurrency)
+BACKOFF = 0.5
+CONCURRENCY_START = 8
+CONCURRENCY_MAX = 64
+
+# regex expression of the start of a talk's values in its web page (a JSON
+# object), and bytes of the object at most
+REGEX_TALK = re.compile('{"id":\d+,')
+TALK_MAX_SIZE = 2 ** 20
+
+
+class Meter():
+    """
+
+    Where the measures of the shared code go: the seconds and bytes of its
+    phases ('talk pages', 'subtitle fetch'...), its counters, and the bytes
+    that it reads from the network, to share the bandwidth.
+
+    They are dropped unless a script sets where they go (see configure()),
+    as TEDTalks.py does with its metrics and its limit of bandwidth.
+
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, metrics=None, consume=None):
+        """Set where the measures go.
+
+        (Metrics) metrics -- the metrics of the run, with the methods add()
+                             and count() (None, they are dropped)
+        (callable) consume -- called as consume(size) with the bytes read
+                              (None, the bandwidth isn't limited)
+
+        """
+        self.metrics = metrics
+        self.consume = consume or (lambda size: None)
+
+    @contextlib.contextmanager
+    def timer(self, phase, size=0):
+        """Time the block of a 'with' statement as a call to a phase."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start, size)
+
+    def add(self, phase, seconds, size=0):
+        """Add a call to a phase, with its seconds and bytes processed."""
+        if self.metrics:
+            self.metrics.add(phase, seconds, size)
+
+    def count(self, counter, value=1):
+        """Increase a counter."""
+        if self.metrics:
+            self.metrics.count(counter, value)
+
+
+# where the measures of the shared code go
+METER = Meter()
+
+
+class ResponseStream():
+    """
+
+    A response (e.g. the feed, or a talk's page) read by pieces by its
+    parser.
+
+    Counts the bytes read and shares the bandwidth with the other transfers
+    (see Meter).
+
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.size = 0
+
+    def read(self, size=CHUNK_SIZE):
+        data = self.response.read(size)
+        self.size += len(data)
+        METER.consume(len(data))
+        return data
+
+
+class TalkCache():
+    """
+
+    Keep the values scraped from the talks' web pages between runs.
+
+    The values of every talk (its id, intro duration, download urls and web
+    page) are stored by its id in a pickle file, so a talk's web page is read
+    only once. The entries older than the ttl are dropped and read again from
+    the web page, just in case TED changes them.
+
+    """
+
+    def __init__(self, filename='.talks.pkl', ttl=CACHE_TTL):
+        """Load the cache from its file (if exists).
+
+        (str) filename -- the name of the cache's file
+        (int) ttl -- the seconds that an entry is valid
+
+        """
+        self.filename = filename
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__changed = False
+        try:
+            with open(filename, 'rb') as pkl_file:
+                cache = pickle.load(pkl_file)
+            if cache.get('version') != 1:
+                raise ValueError('Unknown cache version')
+            self.__talks, self.__pages = cache['talks'], cache['pages']
+        except (EOFError, IOError, ValueError, KeyError, AttributeError,
+                pickle.PickleError):
+            self.__talks, self.__pages = {}, {}
+
+    def get(self, key):
+        """Get the values of a talk by its id or web page url (or None)."""
+        with self.__lock:
+            talk = self.__talks.get(self.__pages.get(key, key))
+            if talk and time.time() - talk['time'] > self.__ttl:
+                self.__drop(talk)
+                talk = None
+            return talk
+
+    def put(self, talk):
+        """Store the values of a talk, a dict with the keys 'id', 'intro',
+        'urls' & 'page' (and 'unavailable', see mark_unavailable())."""
+        with self.__lock:
+            talk['time'] = time.time()
+            self.__talks[talk['id']] = talk
+            self.__pages[talk['page']] = talk['id']
+            self.__changed = True
+
+    def mark_unavailable(self, key, langs):
+        """Record the subtitles' languages that TED hasn't for a talk."""
+        with self.__lock:
+            talk = self.__talks.get(self.__pages.get(key, key))
+            if talk:
+                talk['unavailable'] = sorted(set(talk.get('unavailable', [])) |
+                                             set(langs))
+                self.__changed = True
+
+    def invalidate(self, key):
+        """Drop a talk by its id or web page url."""
+        with self.__lock:
+            talk = self.__talks.get(self.__pages.get(key, key))
+            if talk:
+                self.__drop(talk)
+
+    def __drop(self, talk):
+        """Drop a talk from the cache."""
+        self.__talks.pop(talk['id'], None)
+        if self.__pages.get(talk['page']) == talk['id']:
+            del self.__pages[talk['page']]
+        self.__changed = True
+
+    def save(self):
+        """Write the cache to its file, only if it has changed."""
+        with self.__lock:
+            if not self.__changed:
+                return
+            # A temporary file of its own, another process (the other
+            # script, or another host) may save it too
+            fd, tmp_name = tempfile.mkstemp('.tmp', self.filename, '.')
+            with os.fdopen(fd, 'wb') as pkl_file:
+                pickle.dump({'version': 1, 'talks': self.__talks,
+                             'pages': self.__pages}, pkl_file)
+            os.rename(tmp_name, self.filename)
+            self.__changed = False
+
+
+class Concurrency():
+    """
+
+    Limit of the requests in flight to a host, adapted to how it answers.
+
+    Works like the congestion control of TCP (AIMD): the limit grows by one
+    after every 'limit' requests answered in time (additive increase), and
+    it's halved when the host throttles the requests (a 429 or 5xx status, a
+    timeout or a TED's error message of the kind) or when they take much
+    longer than the fastest ones (multiplicative decrease), at most once in
+    two usual latencies (a round trip). So the requests at the same time find
+    by themselves the most that the host stands, instead of a hand-tuned
+    number.
+
+    A request holds its slot from when it's sent until its response's
+    headers arrive, the time that the host works on it.
+
+    """
+
+    def __init__(self, start=CONCURRENCY_START, maximum=CONCURRENCY_MAX,
+                 slow=4.0):
+        """Create the limit.
+
+        (int) start -- the requests in flight at first
+        (int) maximum -- the requests in flight at most
+        (float) slow -- times the usual latency that is too slow
+
+        """
+        self.limit = start
+        self.maximum = maximum
+        self.__slow = slow
+        self.__latency = None
+        self.__flying = 0
+        self.__answered = 0
+        self.__cut = 0
+        self.__cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a slot to send a request."""
+        with self.__cond:
+            while self.__flying >= self.limit:
+                self.__cond.wait()
+            self.__flying += 1
+
+    def release(self, seconds=None, throttled=False):
+        """Free the slot of a request.
+
+        (float) seconds -- the latency of the request, None if it failed
+                           (e.g. a keep-alive connection closed)
+        (bool) throttled -- if the host throttled the request
+
+        """
+        with self.__cond:
+            self.__flying -= 1
+            if throttled:
+                self.__decrease()
+            elif seconds is not None:
+                # The usual latency follows the fastest ones, rising slowly
+                if self.__latency is None or seconds < self.__latency:
+                    self.__latency = seconds
+                else:
+                    self.__latency += (seconds - self.__latency) / 100
+                if seconds > self.__slow * self.__latency + 0.05:
+                    self.__decrease()
+                else:
+                    self.__answered += 1
+                    if self.__answered >= self.limit:
+                        self.limit = min(self.limit + 1, self.maximum)
+                        self.__answered = 0
+            self.__cond.notify_all()
+
+    def throttled(self):
+        """Halve the limit, the host throttled a request already answered."""
+        with self.__cond:
+            self.__decrease()
+
+    def __decrease(self):
+        """Halve the limit, once a round trip at most."""
+        if time.time() - self.__cut >= 2 * (self.__latency or 0.5):
+            self.limit = max(1, self.limit // 2)
+            self.__answered = 0
+            self.__cut = time.time()
+
+
+class HTTPPool():
+    """
+
+    Reuse the HTTP connections (keep-alive) between the requests to a host.
+
+    The idle connections are kept by scheme & host, so every request to a
+    host already visited saves the DNS lookup and the TCP handshake. The
+    requests have a timeout, are retried on network errors (e.g. a keep-alive
+    connection closed by the server) and follow the redirections. Honors the
+    proxies of the environment (http_proxy, no_proxy...), like urllib2 does.
+
+    The requests in flight to every host are limited by its Concurrency, and
+    the ones throttled (a 429 or 5xx status, or a timeout) are retried after
+    a random wait (jitter) that doubles with every retry, or the one asked by
+    the host (Retry-After).
+
+    """
+
+    def __init__(self, timeout=30, retries=2, size=8, observer=None,
+                 throttled=5):
+        """Create the pool.
+
+        (int) timeout -- seconds to wait for the server
+        (int) retries -- times to retry a request after a network error
+        (int) throttled -- times to retry a request throttled
+        (int) size -- maximum of idle connections kept for every host
+        (callable) observer -- called as observer(status, retries) for every
+                               response received (e.g. to count them)
+
+        """
+        self.observer = observer
+        self.timeout = timeout
+        self.retries = retries
+        self.throttled = throttled
+        self.__size = size
+        self.__idle = {}
+        self.__lock = threading.Lock()
+        self.__proxies = None
+        self.__limits = {}
+
+    def __connection(self, scheme, host):
+        """Get an idle connection to the host or a new one."""
+        with self.__lock:
+            idle = self.__idle.get((scheme, host))
+            if idle:
+                return idle.pop()
+        if self.__proxies is None:
+            self.__proxies = urllib.getproxies()
+        proxy = self.__proxies.get(scheme)
+        if proxy and not urllib.proxy_bypass(host.split(':')[0]):
+            proxy_host = urlparse.urlsplit(proxy).netloc or proxy
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(proxy_host,
+                                               timeout=self.timeout)
+                conn.set_tunnel(host)
+                return conn
+            conn = httplib.HTTPConnection(proxy_host, timeout=self.timeout)
+            conn.proxied = True
+            return conn
+        factory = {'http': httplib.HTTPConnection,
+                   'https': httplib.HTTPSConnection}[scheme]
+        return factory(host, timeout=self.timeout)
+
+    def concurrency(self, url):
+        """The Concurrency of the host of a url."""
+        host = urlparse.urlsplit(url).netloc
+        with self.__lock:
+            if host not in self.__limits:
+                self.__limits[host] = Concurrency()
+            return self.__limits[host]
+
+    def limits(self):
+        """The requests in flight allowed now by host, a dict."""
+        with self.__lock:
+            return dict((host, limit.limit) for host, limit in
+                        self.__limits.items())
+
+    def backoff(self, attempt, retry_after=None):
+        """Wait before retrying a request throttled.
+
+        (int) attempt -- the attempts made before, from 0
+        (str) retry_after -- the seconds asked by the host (Retry-After)
+
+        """
+        if retry_after and retry_after.strip().isdigit():
+            delay = min(int(retry_after), self.timeout)
+        else:
+            delay = random.uniform(0, BACKOFF * 2 ** attempt)
+        time.sleep(delay)
+
+    def __release(self, scheme, host, conn, response):
+        """Keep the connection for the next request, if it's reusable."""
+        if response.isclosed() and not response.will_close:
+            with self.__lock:
+                idle = self.__idle.setdefault((scheme, host), [])
+                if len(idle) < self.__size:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def __request(self, url, headers, method):
+        """Send a request, following the redirections.
+
+        Returns the response plus the scheme, host & connection of the last
+        request sent.
+
+        """
+        for _ in range(5):
+            scheme, host, path, query, _ = urlparse.urlsplit(url)
+            path = '{0}?{1}'.format(path, query) if query else path or '/'
+            limit = self.concurrency(url)
+            errors = 0
+            for attempt in itertools.count():
+                conn = self.__connection(scheme, host)
+                target = url if getattr(conn, 'proxied', False) else path
+                limit.acquire()
+                start = time.time()
+                try:
+                    conn.request(method, target, headers=headers or {})
+                    response = conn.getresponse(buffering=True)
+                except (socket.error, httplib.HTTPException):
+                    conn.close()
+                    timeout = isinstance(sys.exc_info()[1], socket.timeout)
+                    limit.release(throttled=timeout)
+                    errors += 1
+                    if errors > self.retries:
+                        raise
+                    if timeout:
+                        self.backoff(attempt)
+                    continue
+                throttled = response.status == 429 or response.status >= 500
+                limit.release(time.time() - start, throttled)
+                if not throttled or attempt - errors >= self.throttled:
+                    break
+                if self.observer:
+                    self.observer(response.status, 0)
+                response.read()
+                self.__release(scheme, host, conn, response)
+                self.backoff(attempt, response.getheader('Retry-After'))
+            if self.observer:
+                self.observer(response.status, attempt)
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                self.__release(scheme, host, conn, response)
+                url = urlparse.urljoin(url, location)
+                continue
+            return response, scheme, host, conn
+        raise urllib2.HTTPError(url, response.status, 'Too many redirections',
+                                response.msg, None)
+
+    @contextlib.contextmanager
+    def open(self, url, headers=None, method='GET'):
+        """Send a request and give its response to a 'with' block.
+
+        (str) url -- the url requested
+        (dict) headers -- the headers of the request
+        (str) method -- the HTTP method
+
+        The connection returns to the pool when the block ends, if all the
+        response was read, or it's closed if not.
+
+        """
+        response, scheme, host, conn = self.__request(url, headers, method)
+        try:
+            yield response
+        finally:
+            self.__release(scheme, host, conn, response)
+
+    def read(self, url, headers=None):
+        """Get the content of a url.
+
+        Raises a urllib2.HTTPError if the server answers with an error status.
+
+        """
+        with self.open(url, headers) as response:
+            content = response.read()
+            if response.status >= 400:
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.msg, None)
+        return content
+
+    def head(self, url):
+        """Get the headers of a url (a mimetools.Message)."""
+        with self.open(url, method='HEAD') as response:
+            response.read()
+            if response.status >= 400:
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.msg, None)
+        return response.msg
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.__lock:
+            for idle in self.__idle.values():
+                for conn in idle:
+                    conn.close()
+            self.__idle = {}
+
+
+# the pool of connections shared by all the requests
+HTTP = HTTPPool()
+
+
+def parse_size(size):
+    """Convert a size like 500K, 1.5M or 2G (or a rate, by second) to bytes."""
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size or 0))
+
+
+def srt_time(tst):
+    """Format Time from TED Subtitles format (milliseconds) to SRT time Format.
+
+    Only integer divisions, the milliseconds are padded with zeros (e.g. 012).
+
+    """
+    hours, tst = divmod(int(round(tst)), 3600000)
+    mins, tst = divmod(tst, 60000)
+    secs, msecs = divmod(tst, 1000)
+    return '{0:02d}:{1:02d}:{2:02d},{3:03d}'.format(hours, mins, secs, msecs)
+
+
+def srt_lines(captions, tt_intro):
+    """Convert the TED captions to SRT, yielding a subtitle at a time."""
+    for caption_idx, caption in enumerate(captions, 1):
+        start = tt_intro + caption['startTime']
+        end = start + caption['duration']
+        yield '{0}\n{1} --> {2}\n{3}\n\n'.format(caption_idx,
+                                                 srt_time(start),
+                                                 srt_time(end),
+                                                 caption['content'].
+                                                 encode('utf-8'))
+
+
+def write_srt(sub, captions, tt_intro):
+    """Write the captions as a SRT file, renamed to its name when complete."""
+    part_name = '{0}.part'.format(sub)
+    with open(part_name, 'w') as srt_file:
+        srt_file.writelines(srt_lines(captions, tt_intro))
+    os.rename(part_name, sub)
+
+
+def ted_busy(json_object):
+    """Tell if a TED's error message (a JSON object with its 'status') means
+    that it's throttling the requests (a 429 or 5xx code), not that it hasn't
+    the subtitle."""
+    status = json_object.get('status') or {}
+    try:
+        code = int(status.get('code') or 0)
+    except (TypeError, ValueError):
+        code = 0
+    return (code == 429 or code >= 500 or
+            'too many' in unicode(status.get('message', '')).lower())
+
+
+def read_sub(sub_url):
+    """Read the lines of a TED Subtitle in JSON format.
+
+    TED answers with an error message (a JSON 'status') both when it hasn't
+    the subtitle and when it's throttling the requests, the second ones are
+    retried after a random wait (see HTTPPool.backoff()) and reported to the
+    host's Concurrency, like a 429 status.
+
+    """
+    for attempt in range(HTTP.throttled + 1):
+        json_file = HTTP.read(sub_url).splitlines()
+        METER.consume(sum(len(line) for line in json_file))
+        busy = [line for line in json_file if 'status' in line and
+                'captions' not in line]
+        try:
+            if not busy or not ted_busy(json.loads(busy[0])):
+                return json_file
+        except ValueError:
+            return json_file
+        if attempt < HTTP.throttled:
+            HTTP.concurrency(sub_url).throttled()
+            HTTP.backoff(attempt)
+    return json_file
+
+
+def get_sub(tt_id, tt_intro, lang, sub):
+    """Get TED Subtitle in JSON format & convert it to SRT Subtitle.
+
+    The SRT subtitle is written straight to its file, caption by caption.
+    Returns the result, 'downloaded', 'unavailable' (TED hasn't it), 'busy'
+    (TED is too busy now) or 'error', and a message if something went wrong.
+
+    """
+    result, message = 'error', ''
+    tt_url = 'http://www.ted.com/talks'
+    sub_url = '{0}/subtitles/id/{1}/lang/{2}'.format(tt_url, tt_id, lang)
+    # Get JSON sub
+    start = time.time()
+    try:
+        json_file = read_sub(sub_url)
+    except (IOError, httplib.HTTPException):
+        json_file = []
+        message = "Subtitle '{0}' not found.".format(sub)
+    METER.add('subtitle fetch', time.time() - start,
+              sum(len(line) for line in json_file))
+    # The JSON object is in the line with the captions or the error status
+    json_line = next((line for line in json_file if 'captions' in line or
+                      'status' in line), None)
+    if json_line:
+        try:
+            json_object = json.loads(json_line)
+            if 'captions' in json_object:
+                if json_object['captions']:
+                    with METER.timer('subtitle conversion'):
+                        write_srt(sub, json_object['captions'], tt_intro)
+                    result = 'downloaded'
+                else:
+                    result = 'unavailable'
+                    message = "Subtitle '{0}' not available.".format(sub)
+            elif 'status' in json_object and ted_busy(json_object):
+                METER.count('subtitles throttled')
+                result = 'busy'
+                message = ("TED is too busy now ({0}), the subtitle '{1}' is "
+                           "left for the next run.".format(
+                               json_object['status'].get('message'), sub))
+            elif 'status' in json_object:
+                result = 'unavailable'
+                message = ("This is an error message returned by TED:{0}{0} - "
+                           "{1}{0}{0}Probably because the subtitle '{2}' is "
+                           "not available.{0}".
+                           format(os.linesep,
+                                  json_object['status']['message'], sub))
+        except ValueError:
+            message = "Subtitle '{0}' it's a malformed json file.".format(sub)
+    return result, message
+
+
+class ScrapeError(Exception):
+    """The values of a talk aren't in its web page."""
+
+
+def scrape_page(stream, url):
+    """Read the values of a talk from its web page, while it's downloaded.
+
+    (file) stream -- the page, read by chunks (e.g. a ResponseStream)
+    (str) url -- the page's url, for the errors
+
+    The values are a JSON object in a script of the page, starting with the
+    talk's id. It's decoded at once, and the rest of the page (most of it)
+    isn't read. Returns a dict with the keys 'id', 'intro' (the intro's
+    milliseconds), 'urls' (the videos by quality, without their query
+    strings, empty if the talk has no video), 'title' & 'published' (None if
+    unknown). Raises a ScrapeError if the page hasn't the values.
+
+    """
+    decoder = json.JSONDecoder()
+    page, found, chunk = '', False, True
+    while chunk:
+        chunk = stream.read(CHUNK_SIZE)
+        page += chunk
+        while True:
+            if not found:
+                match = REGEX_TALK.search(page)
+                if match is None:
+                    # Only the end of the page read can start the object
+                    page = page[-32:]
+                    break
+                page, found = page[match.start():], True
+            try:
+                talk, _ = decoder.raw_decode(page)
+            except ValueError:
+                # Half read yet, or not a JSON object at all
+                if chunk and len(page) < TALK_MAX_SIZE:
+                    break
+                talk = {}
+            if 'introDuration' in talk:
+                downloads = talk.get('nativeDownloads') or {}
+                return {'id': int(talk['id']),
+                        'intro': (float(talk['introDuration']) + 1) * 1000,
+                        'urls': dict((str(quality), str(video.split('?')[0]))
+                                     for quality, video in downloads.items()
+                                     if video),
+                        'title': talk.get('name'),
+                        'published': talk.get('published')}
+            page, found = page[1:], False
+    raise ScrapeError("The talk's values aren't in its web page {0}".
+                      format(url))
+
+
+def read_page(url):
+    """Read the values of a talk from its web page, see scrape_page().
+
+    Raises a urllib2.HTTPError if the server answers with an error status.
+
+    """
+    with HTTP.open(url) as response:
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        stream = ResponseStream(response)
+        start = time.time()
+        try:
+            values = scrape_page(stream, url)
+            # The rest of the page is read only if it's short, it takes less
+            # than to open a new connection
+            if response.length is not None and response.length <= CHUNK_SIZE:
+                stream.read(CHUNK_SIZE)
+            return values
+        finally:
+            METER.add('talk pages', time.time() - start, stream.size)